@@ -0,0 +1,18 @@
+"""Load the project .env file once per process."""
+
+from functools import lru_cache
+from pathlib import Path
+from dotenv import load_dotenv
+
+ENV_PATH = Path(__file__).parent.parent / ".env"
+
+
+@lru_cache(maxsize=1)
+def load_env():
+    """Load ENV_PATH into os.environ; later calls are no-ops.
+
+    Returns:
+        Path: The .env path, for use in error messages
+    """
+    load_dotenv(ENV_PATH)
+    return ENV_PATH
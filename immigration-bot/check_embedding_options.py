@@ -1,13 +1,12 @@
 """Check available embedding options in MongoDB Atlas."""
 
 import os
-from pathlib import Path
-from dotenv import load_dotenv
-from pymongo import MongoClient
+
+from _env import load_env
+from db import get_client
 
 # Load environment variables
-env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(env_path)
+load_env()
 
 MONGODB_URI = os.environ.get("MONGODB_URI")
 DATABASE_NAME = "rfe_tool"
@@ -21,7 +20,7 @@ def main():
 
     # Connect to MongoDB
     print(f"\nConnecting to MongoDB Atlas...")
-    client = MongoClient(MONGODB_URI)
+    client = get_client()
     db = client[DATABASE_NAME]
 
     # Get cluster info
@@ -44,7 +43,7 @@ def main():
     # List collections in rfe_tool
     print(f"\nCollections in '{DATABASE_NAME}':")
     for coll_name in db.list_collection_names():
-        count = db[coll_name].count_documents({})
+        count = db[coll_name].estimated_document_count()
         print(f"  - {coll_name}: {count} documents")
 
     # Check for Atlas Search indexes
@@ -80,30 +79,44 @@ def main():
     print("-" * 80)
 
     cases_coll = db["cases"]
-    total = cases_coll.count_documents({})
+
+    # One round-trip for per-status and embedding counts
+    pipeline = [{"$facet": {
+        "by_status": [{"$group": {"_id": "$status", "n": {"$sum": 1}}}],
+        "with_emb": [{"$match": {"embedding": {"$exists": True}}}, {"$count": "n"}],
+    }}]
+    stats = next(cases_coll.aggregate(pipeline), {})
+    status_counts = {s["_id"]: s["n"] for s in stats.get("by_status", [])}
+    total = cases_coll.estimated_document_count()
 
     print(f"\nTotal cases: {total}")
     print("\nStatus breakdown:")
     for status in ["embedded", "features_extracted", "text_extracted", "uploaded", "embedding_failed"]:
-        count = cases_coll.count_documents({"status": status})
+        count = status_counts.get(status, 0)
         if count > 0:
             print(f"  - {status}: {count}")
 
     # Check if any cases already have embeddings
-    with_embeddings = cases_coll.count_documents({"embedding": {"$exists": True}})
+    with_embeddings = stats["with_emb"][0]["n"] if stats.get("with_emb") else 0
     print(f"\nCases with embeddings: {with_embeddings}")
 
     # Sample a case to see structure
-    sample = cases_coll.find_one({"status": "features_extracted"})
+    # Computed server-side so full_text and embedding never cross the wire
+    sample = cases_coll.find_one({"status": "features_extracted"}, {
+        "filename": 1,
+        "status": 1,
+        "text_length": {"$strLenCP": {"$ifNull": ["$full_text", ""]}},
+        "has_embedding": {"$ne": [{"$type": "$embedding"}, "missing"]},
+    })
     if sample:
         print("\n" + "-" * 80)
         print("SAMPLE CASE STRUCTURE:")
         print("-" * 80)
         print(f"\nFilename: {sample.get('filename')}")
         print(f"Status: {sample.get('status')}")
-        print(f"Has full_text: {'Yes' if sample.get('full_text') else 'No'}")
-        print(f"Text length: {len(sample.get('full_text', ''))} chars")
-        print(f"Has embedding: {'Yes' if sample.get('embedding') else 'No'}")
+        print(f"Has full_text: {'Yes' if sample.get('text_length') else 'No'}")
+        print(f"Text length: {sample.get('text_length', 0)} chars")
+        print(f"Has embedding: {'Yes' if sample.get('has_embedding') else 'No'}")
 
     # Recommendations
     print("\n" + "=" * 80)
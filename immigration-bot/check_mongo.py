@@ -1,16 +1,12 @@
 """Quick script to view MongoDB GridFS data."""
 
-import os
-from pathlib import Path
-from dotenv import load_dotenv
-from pymongo import MongoClient
+from _env import load_env
+from db import get_client
 
 # Load environment variables
-env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(env_path)
+load_env()
 
-MONGODB_URI = os.environ.get("MONGODB_URI")
-client = MongoClient(MONGODB_URI)
+client = get_client()
 db = client["rfe_tool"]
 
 print("=" * 70)
@@ -28,7 +24,7 @@ for i, case in enumerate(cases, 1):
     print(f"   Uploaded: {case['uploaded_at']}")
     print()
 
-total_cases = db["cases"].count_documents({})
+total_cases = db["cases"].estimated_document_count()
 print(f"Total cases: {total_cases}")
 
 # Show GridFS files
@@ -43,14 +39,14 @@ for i, file in enumerate(files, 1):
     print(f"   Upload Date: {file.get('uploadDate', 'N/A')}")
     print()
 
-total_files = db.fs.files.count_documents({})
+total_files = db.fs.files.estimated_document_count()
 print(f"Total GridFS files: {total_files}")
 
 # Show collections
 print("\n📊 ALL COLLECTIONS IN DATABASE:")
 print("-" * 70)
 for collection_name in db.list_collection_names():
-    count = db[collection_name].count_documents({})
+    count = db[collection_name].estimated_document_count()
     print(f"  • {collection_name}: {count} documents")
 
 print("\n" + "=" * 70)
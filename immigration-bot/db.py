@@ -2,27 +2,48 @@
 
 import os
 import logging
-from dotenv import load_dotenv
+from functools import lru_cache
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 
-load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
+from _env import load_env
+
+load_env()
 logger = logging.getLogger(__name__)
 
 MONGODB_URI = os.getenv("MONGODB_URI")
 
-client = None
-db = None
+# Compress the wire (full_text is very compressible) and make the write
+# concern explicit; compressors whose module isn't installed are skipped
+CLIENT_OPTIONS = {
+    "compressors": "zstd,zlib",
+    "retryWrites": True,
+    "w": 1,
+    "maxPoolSize": 50,
+}
+
+@lru_cache(maxsize=1)
+def get_client():
+    """Return the process-wide MongoClient, creating it on first use.
+
+    Returns:
+        MongoClient or None if MONGODB_URI is not configured
+    """
+    if not MONGODB_URI:
+        logger.warning("MONGODB_URI not set – skipping MongoDB connection")
+        return None
+    return MongoClient(MONGODB_URI, server_api=ServerApi("1"), **CLIENT_OPTIONS)
 
-if MONGODB_URI:
-    client = MongoClient(MONGODB_URI, server_api=ServerApi("1"))
-    db = client["pumpkin"]
-else:
-    logger.warning("MONGODB_URI not set – skipping MongoDB connection")
+
+def get_db():
+    """Return the app database, or None if MongoDB is not configured."""
+    client = get_client()
+    return client["pumpkin"] if client is not None else None
 
 
 def ping_db():
     """Ping MongoDB to verify connectivity."""
+    client = get_client()
     if client is None:
         logger.warning("MongoDB client not initialised – no URI configured")
         return False
@@ -33,3 +54,19 @@ def ping_db():
     except Exception as e:
         logger.error("MongoDB connection failed: %s", e)
         return False
+
+
+def ensure_case_indexes(cases_collection):
+    """Create the indexes the pipeline's status filters rely on.
+
+    The compound index also serves plain {"status": ...} filters and counts,
+    so no separate single-field index is needed. create_index is a no-op when
+    the index already exists.
+    """
+    cases_collection.create_index([("status", 1), ("_id", 1)])
+
+
+def status_counts(cases_collection):
+    """Return {status: count} for the collection in one aggregation."""
+    pipeline = [{"$group": {"_id": "$status", "n": {"$sum": 1}}}]
+    return {d["_id"]: d["n"] for d in cases_collection.aggregate(pipeline)}
@@ -1,16 +1,16 @@
 """Export case data for UMAP visualization."""
 
-import os
-import json
+import itertools
 from pathlib import Path
-from dotenv import load_dotenv
-from pymongo import MongoClient
+
+import orjson
+
+from _env import load_env
+from db import get_client, ensure_case_indexes
 
 # Load environment variables
-env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(env_path)
+load_env()
 
-MONGODB_URI = os.environ.get("MONGODB_URI")
 DATABASE_NAME = "rfe_tool"
 
 def main():
@@ -19,50 +19,59 @@ def main():
     print("Exporting case data for visualization...")
 
     # Connect to MongoDB
-    client = MongoClient(MONGODB_URI)
+    client = get_client()
     db = client[DATABASE_NAME]
     cases_collection = db["cases"]
+    ensure_case_indexes(cases_collection)
 
     # Fetch all complete cases
     query = {"status": "complete", "x_2d": {"$exists": True}, "y_2d": {"$exists": True}}
-    cases = list(cases_collection.find(query))
-
-    if len(cases) == 0:
+    projection = {
+        "_id": 0, "filename": 1, "x_2d": 1, "y_2d": 1, "case_number": 1, "outcome": 1,
+        "decision_date": 1, "job_title": 1, "company_name": 1, "company_type": 1,
+        "wage_level": 1, "service_center": 1, "rfe_issues": 1, "denial_reasons": 1,
+    }
+    cursor = cases_collection.find(query, projection)
+
+    first_case = next(cursor, None)
+    if first_case is None:
         print("No complete cases found!")
         client.close()
         return
 
-    # Extract visualization data
-    viz_data = []
-    for case in cases:
-        viz_data.append({
-            "filename": case.get("filename", "unknown"),
-            "x": case.get("x_2d"),
-            "y": case.get("y_2d"),
-            "case_number": case.get("case_number"),
-            "outcome": case.get("outcome"),
-            "decision_date": case.get("decision_date"),
-            "job_title": case.get("job_title"),
-            "company_name": case.get("company_name"),
-            "company_type": case.get("company_type"),
-            "wage_level": case.get("wage_level"),
-            "service_center": case.get("service_center"),
-            "rfe_issues": case.get("rfe_issues", []),
-            "denial_reasons": case.get("denial_reasons", []),
-        })
-
-    # Save to JSON
+    # Write records as they stream off the cursor, one per line
     output_path = Path(__file__).parent / "umap_data.json"
-    with open(output_path, "w") as f:
-        json.dump(viz_data, f, indent=2)
-
-    print(f"✓ Exported {len(viz_data)} cases to: {output_path}")
-
-    # Print summary
-    outcomes = {}
-    for case in viz_data:
-        outcome = case.get("outcome", "UNKNOWN")
-        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    exported = 0
+    with open(output_path, "wb") as f:
+        f.write(b"[\n")
+        for case in itertools.chain([first_case], cursor):
+            record = {
+                "filename": case.get("filename", "unknown"),
+                "x": case.get("x_2d"),
+                "y": case.get("y_2d"),
+                "case_number": case.get("case_number"),
+                "outcome": case.get("outcome"),
+                "decision_date": case.get("decision_date"),
+                "job_title": case.get("job_title"),
+                "company_name": case.get("company_name"),
+                "company_type": case.get("company_type"),
+                "wage_level": case.get("wage_level"),
+                "service_center": case.get("service_center"),
+                "rfe_issues": case.get("rfe_issues", []),
+                "denial_reasons": case.get("denial_reasons", []),
+            }
+            f.write((b",\n" if exported else b"") + orjson.dumps(record))
+            exported += 1
+        f.write(b"\n]\n")
+
+    print(f"✓ Exported {exported} cases to: {output_path}")
+
+    # Print summary (tallied server-side)
+    outcomes_pipeline = [
+        {"$match": query},
+        {"$group": {"_id": "$outcome", "n": {"$sum": 1}}},
+    ]
+    outcomes = {d["_id"] or "UNKNOWN": d["n"] for d in cases_collection.aggregate(outcomes_pipeline)}
 
     print(f"\nOutcome distribution:")
     for outcome, count in sorted(outcomes.items()):
@@ -1,19 +1,28 @@
 """Extract structured features from H-1B AAO decisions using GPT-4."""
 
 import os
-import time
 import json
+import time
+import asyncio
+import argparse
+import itertools
+import tempfile
 from pathlib import Path
 from datetime import datetime
-from dotenv import load_dotenv
 
-from pymongo import MongoClient
-from openai import OpenAI
+import orjson
+import tiktoken
+from bson import ObjectId
+from pymongo import UpdateOne
+from openai import OpenAI, AsyncOpenAI, RateLimitError
 from tqdm import tqdm
 
+from _env import load_env
+from db import get_client, ensure_case_indexes
+from rate_limit import TokenBucket
+
 # Load environment variables
-env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(env_path)
+env_path = load_env()
 
 MONGODB_URI = os.environ.get("MONGODB_URI")
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
@@ -25,9 +34,24 @@ if not MONGODB_URI or not OPENAI_API_KEY:
     )
 
 DATABASE_NAME = "rfe_tool"
-DELAY_BETWEEN_CALLS = 0.5  # seconds
+CONCURRENCY = 20  # GPT-4 requests in flight, paced by the limits below
+# Account tokens- and requests-per-minute limits for MODEL (vary by tier)
+TOKENS_PER_MINUTE = int(os.environ.get("OPENAI_CHAT_TPM", 450_000))
+REQUESTS_PER_MINUTE = int(os.environ.get("OPENAI_CHAT_RPM", 5_000))
+MAX_COMPLETION_TOKENS = 1000  # counted against TPM up front, like prompt tokens
+BULK_WRITE_SIZE = 50  # case updates per MongoDB bulk_write
 MODEL = "gpt-4o"  # or "gpt-4o-mini" for lower cost
 TEMPERATURE = 0  # deterministic
+BATCH_POLL_INTERVAL = 60  # seconds between Batch API status checks
+
+# Decision text budget: long decisions keep their opening (facts, issues)
+# and closing (analysis, outcome) and drop the middle
+MAX_TEXT_TOKENS = 12000
+HEAD_TOKENS = 8000
+TAIL_TOKENS = 4000
+ENCODING = tiktoken.encoding_for_model(MODEL)
+
+SYSTEM_PROMPT = "You are a legal document analyzer that extracts structured data from H-1B appeal decisions."
 
 # GPT-4 extraction prompt
 EXTRACTION_PROMPT = """Extract the following from this AAO H-1B appeal decision.
@@ -48,77 +72,308 @@ Return ONLY valid JSON, no explanation or markdown.
 }"""
 
 
-def extract_features_with_gpt4(full_text, openai_client, max_retries=2):
+def trim_decision_text(full_text):
+    """Trim decision text to the token budget, keeping its head and tail.
+
+    Returns:
+        tuple: (trimmed text, its approximate token count)
+    """
+    tokens = ENCODING.encode(full_text, disallowed_special=())
+    if len(tokens) <= MAX_TEXT_TOKENS:
+        return full_text, len(tokens)
+    text = ENCODING.decode(tokens[:HEAD_TOKENS]) + "\n\n[...]\n\n" + ENCODING.decode(tokens[-TAIL_TOKENS:])
+    return text, HEAD_TOKENS + TAIL_TOKENS
+
+
+# Prompt tokens outside the decision text (instructions, plus ~50 for
+# message framing and separators) and the completion allowance
+REQUEST_OVERHEAD_TOKENS = (
+    len(ENCODING.encode(SYSTEM_PROMPT + EXTRACTION_PROMPT)) + 50 + MAX_COMPLETION_TOKENS
+)
+
+
+def build_chat_request(full_text):
+    """Build the chat completion request body for one decision.
+
+    Returns:
+        tuple: (request body, tokens it counts against the TPM limit)
+    """
+    full_text, n_tokens = trim_decision_text(full_text)
+    body = {
+        "model": MODEL,
+        "temperature": TEMPERATURE,
+        "max_tokens": MAX_COMPLETION_TOKENS,
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"{EXTRACTION_PROMPT}\n\n---\n\nDecision Text:\n{full_text}"}
+        ],
+    }
+    return body, n_tokens + REQUEST_OVERHEAD_TOKENS
+
+
+async def extract_features_with_gpt4(full_text, openai_client, bucket):
     """Extract structured features from decision text using GPT-4.
 
+    JSON mode guarantees the response body is a bare JSON object, so there is
+    no markdown to strip; only a truncated response can fail to parse.
+
+    Raises:
+        RateLimitError: Still rate limited after the client's own retries;
+            the request's tokens have been returned to bucket
+
     Returns:
         dict: Extracted features or None if failed
     """
-    for attempt in range(max_retries):
+    body, n_tokens = build_chat_request(full_text)
+    await bucket.acquire_async(n_tokens)
+    try:
+        response = await openai_client.chat.completions.create(**body)
+        return orjson.loads(response.choices[0].message.content)
+
+    except RateLimitError:
+        bucket.release(n_tokens)
+        raise
+
+    except orjson.JSONDecodeError as e:
+        print(f"    ❌ Failed to parse JSON: {e}")
+        return None
+
+    except Exception as e:
+        print(f"    ❌ GPT-4 API error: {e}")
+        return None
+
+
+async def process_case(idx, total_cases, case, pending, openai_client, bucket):
+    """Extract features for one case and queue its MongoDB update in pending.
+
+    Returns:
+        bool: True if the case was updated with features, False if it was
+        marked failed, None if it was rate limited and left as text_extracted
+    """
+    filename = case["filename"]
+    case_id = case["_id"]
+    full_text = case["full_text"]
+
+    try:
+        print(f"\n[{idx}/{total_cases}] {filename}")
+
+        # Extract features with GPT-4
         try:
-            response = openai_client.chat.completions.create(
-                model=MODEL,
-                temperature=TEMPERATURE,
-                max_tokens=1000,
-                messages=[
-                    {"role": "system", "content": "You are a legal document analyzer that extracts structured data from H-1B appeal decisions."},
-                    {"role": "user", "content": f"{EXTRACTION_PROMPT}\n\n---\n\nDecision Text:\n{full_text}"}
-                ]
-            )
-
-            # Get response content
-            content = response.choices[0].message.content.strip()
-
-            # Remove markdown code blocks if present
-            if content.startswith("```json"):
-                content = content[7:]
-            if content.startswith("```"):
-                content = content[3:]
-            if content.endswith("```"):
-                content = content[:-3]
-            content = content.strip()
-
-            # Parse JSON
-            features = json.loads(content)
-
-            return features
-
-        except json.JSONDecodeError as e:
-            if attempt < max_retries - 1:
-                print(f"    ⚠️  JSON parse error (attempt {attempt + 1}/{max_retries}): {e}")
-                time.sleep(1)
-                continue
-            else:
-                print(f"    ❌ Failed to parse JSON after {max_retries} attempts")
-                return None
-
-        except Exception as e:
-            print(f"    ❌ GPT-4 API error: {e}")
+            features = await extract_features_with_gpt4(full_text, openai_client, bucket)
+        except RateLimitError as e:
+            # Not the case's fault: leave it text_extracted for the next run
+            print(f"  ⚠️  Rate limited, left pending: {e}")
             return None
 
-    return None
+        if features is None:
+            # Mark as failed
+            pending.append(UpdateOne(
+                {"_id": case_id},
+                {"$set": {
+                    "status": "feature_extraction_failed",
+                    "failed_at": datetime.utcnow()
+                }}
+            ))
+            return False
+
+        # Update MongoDB with extracted features
+        update_data = {
+            **features,  # Spread all extracted fields
+            "status": "features_extracted",
+            "features_extracted_at": datetime.utcnow()
+        }
+
+        pending.append(UpdateOne(
+            {"_id": case_id},
+            {"$set": update_data}
+        ))
+
+        # Print result
+        outcome = features.get("outcome", "UNKNOWN")
+        case_num = features.get("case_number", "N/A")
+        print(f"  ✓ {outcome} - {case_num}")
+
+        return True
+
+    except Exception as e:
+        print(f"  ❌ Unexpected error: {e}")
+
+        pending.append(UpdateOne(
+            {"_id": case_id},
+            {"$set": {
+                "status": "feature_extraction_failed",
+                "error": str(e),
+                "failed_at": datetime.utcnow()
+            }}
+        ))
+
+        return False
+
+
+async def process_cases(cases, total_cases, cases_collection, openai_client):
+    """Run feature extraction with up to CONCURRENCY requests in flight.
+
+    Requests are paced by a token bucket sized to TOKENS_PER_MINUTE and
+    REQUESTS_PER_MINUTE. Workers pull from the shared cursor, so only
+    CONCURRENCY documents are held in memory at any time.
+
+    Returns:
+        dict with keys: succeeded, failed, rate_limited
+    """
+    stats = {"succeeded": 0, "failed": 0, "rate_limited": 0}
+    outcome_keys = {True: "succeeded", False: "failed", None: "rate_limited"}
+    counter = itertools.count(1)
+    progress = tqdm(total=total_cases, desc="Extracting features")
+    pending = []
+    bucket = TokenBucket(TOKENS_PER_MINUTE, REQUESTS_PER_MINUTE)
+    cursor_lock = asyncio.Lock()
+
+    async def next_case():
+        # pymongo cursors block on getMore and aren't thread-safe: advance
+        # the cursor in a thread, one worker at a time
+        async with cursor_lock:
+            return await asyncio.to_thread(next, cases, None)
+
+    async def flush():
+        # Swap the buffer out before awaiting so other workers keep appending
+        ops = pending[:]
+        pending.clear()
+        if ops:
+            await asyncio.to_thread(cases_collection.bulk_write, ops, ordered=False)
+
+    async def worker():
+        while (case := await next_case()) is not None:
+            ok = await process_case(next(counter), total_cases, case, pending, openai_client, bucket)
+            stats[outcome_keys[ok]] += 1
+            progress.update(1)
+            if len(pending) >= BULK_WRITE_SIZE:
+                await flush()
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    finally:
+        await flush()
+        progress.close()
+        await openai_client.close()
+
+    return stats
+
+
+def run_batch(cases, cases_collection, openai_client):
+    """Extract features through the OpenAI Batch API.
+
+    Cheaper than interactive calls and not subject to per-minute rate limits,
+    at the cost of up to 24h turnaround. Requests that the batch reports as
+    errored keep status='text_extracted' so they are retried on the next run.
+
+    Returns:
+        dict with keys: succeeded, failed
+    """
+    stats = {"succeeded": 0, "failed": 0}
+
+    # Step 1: Write one chat request per case to a JSONL file
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as tmp:
+        for case in cases:
+            tmp.write(json.dumps({
+                "custom_id": str(case["_id"]),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": build_chat_request(case["full_text"])[0],
+            }) + "\n")
+        tmp_path = Path(tmp.name)
+
+    # Step 2: Upload the requests and start the batch
+    try:
+        with open(tmp_path, "rb") as f:
+            input_file = openai_client.files.create(file=f, purpose="batch")
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    batch = openai_client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    print(f"  Submitted batch {batch.id}")
+
+    # Step 3: Poll until the batch reaches a terminal state
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(BATCH_POLL_INTERVAL)
+        batch = openai_client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        done = f" ({counts.completed}/{counts.total})" if counts else ""
+        print(f"  Batch status: {batch.status}{done}")
+
+    if not batch.output_file_id:
+        print(f"  ❌ Batch {batch.id} ended with status '{batch.status}' and no output")
+        return stats
+
+    # Step 4: Apply all results with a single bulk write
+    now = datetime.utcnow()
+    ops = []
+    output = openai_client.files.content(batch.output_file_id)
+    for line in output.text.splitlines():
+        result = orjson.loads(line)
+        response = result.get("response") or {}
+
+        features = None
+        if response.get("status_code") == 200:
+            try:
+                features = orjson.loads(response["body"]["choices"][0]["message"]["content"])
+            except orjson.JSONDecodeError:
+                pass
+
+        if features is None:
+            update_data = {"status": "feature_extraction_failed", "failed_at": now}
+            stats["failed"] += 1
+        else:
+            update_data = {**features, "status": "features_extracted", "features_extracted_at": now}
+            stats["succeeded"] += 1
+
+        ops.append(UpdateOne({"_id": ObjectId(result["custom_id"])}, {"$set": update_data}))
+
+    if ops:
+        cases_collection.bulk_write(ops, ordered=False)
+
+    return stats
 
 
 def main():
     """Main feature extraction pipeline."""
 
+    parser = argparse.ArgumentParser(description="Extract structured features from AAO decisions")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit through the OpenAI Batch API (half price, up to 24h turnaround)")
+    args = parser.parse_args()
+
     print("=" * 80)
     print("GPT-4 FEATURE EXTRACTION PIPELINE")
     print("=" * 80)
 
     # Connect to MongoDB
     print(f"\nConnecting to MongoDB...")
-    client = MongoClient(MONGODB_URI)
+    client = get_client()
     db = client[DATABASE_NAME]
     cases_collection = db["cases"]
-
-    # Initialize OpenAI client
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
+    ensure_case_indexes(cases_collection)
+
+    # Cases without text can't be extracted: fail them in one write rather
+    # than fetching each one just to skip it
+    no_text = cases_collection.update_many(
+        {"status": "text_extracted", "full_text": {"$in": [None, ""]}},
+        {"$set": {
+            "status": "feature_extraction_failed",
+            "error": "No full_text found",
+            "failed_at": datetime.utcnow()
+        }}
+    )
+    if no_text.modified_count:
+        print(f"\n❌ Marked {no_text.modified_count} cases without full_text as failed")
 
     # Get all cases that need feature extraction
     query = {"status": "text_extracted"}
-    cases_to_process = list(cases_collection.find(query))
-    total_cases = len(cases_to_process)
+    total_cases = cases_collection.count_documents(query)
 
     if total_cases == 0:
         print("\n✓ No cases found with status='text_extracted'")
@@ -129,80 +384,20 @@ def main():
     print(f"\nFound {total_cases} cases to process")
     print(f"Using model: {MODEL}")
     print(f"Temperature: {TEMPERATURE}")
+    print(f"Mode: {'Batch API' if args.batch else f'interactive, concurrency {CONCURRENCY}, {TOKENS_PER_MINUTE} TPM / {REQUESTS_PER_MINUTE} RPM'}")
     print("\n" + "-" * 80)
 
-    succeeded = 0
-    failed = 0
-
-    # Process each case
-    for idx, case in enumerate(tqdm(cases_to_process, desc="Extracting features"), 1):
-        filename = case["filename"]
-        case_id = case["_id"]
-        full_text = case.get("full_text", "")
-
-        if not full_text:
-            print(f"\n[{idx}/{total_cases}] {filename}")
-            print(f"  ❌ No full_text found")
-            failed += 1
-            continue
-
-        try:
-            print(f"\n[{idx}/{total_cases}] {filename}")
-
-            # Extract features with GPT-4
-            features = extract_features_with_gpt4(full_text, openai_client)
-
-            if features is None:
-                # Mark as failed
-                cases_collection.update_one(
-                    {"_id": case_id},
-                    {"$set": {
-                        "status": "feature_extraction_failed",
-                        "failed_at": datetime.utcnow()
-                    }}
-                )
-                failed += 1
-                continue
-
-            # Update MongoDB with extracted features
-            update_data = {
-                **features,  # Spread all extracted fields
-                "status": "features_extracted",
-                "features_extracted_at": datetime.utcnow()
-            }
-
-            cases_collection.update_one(
-                {"_id": case_id},
-                {"$set": update_data}
-            )
-
-            # Print result
-            outcome = features.get("outcome", "UNKNOWN")
-            case_num = features.get("case_number", "N/A")
-            print(f"  ✓ {outcome} - {case_num}")
-
-            succeeded += 1
-
-            # Rate limiting
-            if idx < total_cases:
-                time.sleep(DELAY_BETWEEN_CALLS)
-
-        except Exception as e:
-            print(f"  ❌ Unexpected error: {e}")
-
-            cases_collection.update_one(
-                {"_id": case_id},
-                {"$set": {
-                    "status": "feature_extraction_failed",
-                    "error": str(e),
-                    "failed_at": datetime.utcnow()
-                }}
-            )
-
-            failed += 1
-
-            if idx < total_cases:
-                time.sleep(DELAY_BETWEEN_CALLS)
+    # full_text is large: fetch roughly one worker pool's worth per round-trip
+    cursor = cases_collection.find(query, {"_id": 1, "filename": 1, "full_text": 1}).batch_size(CONCURRENCY)
+    if args.batch:
+        stats = run_batch(cursor, cases_collection, OpenAI(api_key=OPENAI_API_KEY))
+    else:
+        # Process cases concurrently
+        openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+        stats = asyncio.run(process_cases(cursor, total_cases, cases_collection, openai_client))
+    succeeded = stats["succeeded"]
+    failed = stats["failed"]
+    rate_limited = stats.get("rate_limited", 0)
 
     # Summary
     print("\n" + "=" * 80)
@@ -211,6 +406,8 @@ def main():
     print(f"Total processed: {total_cases}")
     print(f"✓ Succeeded: {succeeded}")
     print(f"❌ Failed: {failed}")
+    if rate_limited:
+        print(f"⚠️  Rate limited, left pending for the next run: {rate_limited}")
     print("\nUpdated status in MongoDB:")
     print(f"  - features_extracted: {cases_collection.count_documents({'status': 'features_extracted'})}")
     print(f"  - feature_extraction_failed: {cases_collection.count_documents({'status': 'feature_extraction_failed'})}")
@@ -221,7 +418,11 @@ def main():
         print("\n" + "-" * 80)
         print("SAMPLE EXTRACTED FEATURES:")
         print("-" * 80)
-        sample = cases_collection.find_one({"status": "features_extracted"})
+        sample = cases_collection.find_one({"status": "features_extracted"}, {
+            "_id": 0, "filename": 1, "case_number": 1, "outcome": 1, "decision_date": 1,
+            "job_title": 1, "company_name": 1, "company_type": 1, "wage_level": 1,
+            "rfe_issues": 1, "denial_reasons": 1, "arguments_made": 1,
+        })
         if sample:
             print(f"\nFilename: {sample.get('filename')}")
             print(f"Case Number: {sample.get('case_number')}")
@@ -1,21 +1,20 @@
 """Extract text from PDFs in MongoDB using Reducto API."""
 
 import os
-import time
-import tempfile
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from dotenv import load_dotenv
 
 import requests
-from pymongo import MongoClient
-from gridfs import GridFS
+from pymongo import UpdateOne
+from gridfs import GridFSBucket
 from reducto import Reducto
 from tqdm import tqdm
 
+from _env import load_env
+from db import get_client, ensure_case_indexes
+
 # Load environment variables
-env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(env_path)
+env_path = load_env()
 
 MONGODB_URI = os.environ.get("MONGODB_URI")
 REDUCTO_API_KEY = os.environ.get("REDUCTO_API_KEY")
@@ -27,72 +26,114 @@ if not MONGODB_URI or not REDUCTO_API_KEY:
     )
 
 DATABASE_NAME = "rfe_tool"
-DELAY_BETWEEN_CALLS = 1  # seconds
+MAX_WORKERS = 8  # concurrent Reducto extractions
+BULK_WRITE_SIZE = 50  # case updates per MongoDB bulk_write
 
 
-def extract_text_from_pdf(pdf_bytes, filename, reducto_client):
+def extract_text_from_pdf(pdf_file, filename, reducto_client):
     """Extract text from PDF using Reducto API.
 
+    Args:
+        pdf_file: PDF bytes or a readable binary file object (streamed in chunks)
+
     Returns:
         dict with keys: full_text, pages, page_count, tables (if any)
     """
-    # Write PDF to temp file (Reducto SDK requires file path)
-    suffix = Path(filename).suffix or ".pdf"
-    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-        tmp.write(pdf_bytes)
-        tmp_path = Path(tmp.name)
+    # Step 1: Upload to Reducto without a temp file round-trip
+    print(f"  Uploading to Reducto...")
+    upload_result = reducto_client.upload(file=(filename, pdf_file, "application/pdf"))
+
+    # Step 2: Parse the uploaded file
+    print(f"  Parsing (file_id: {upload_result.file_id})...")
+    parse_response = reducto_client.parse.run(
+        input=f"reducto://{upload_result.file_id}",
+    )
+
+    result = parse_response.result
+    chunks = []
+
+    # Step 3: Extract chunks (two possible response formats)
+    if hasattr(result, "chunks"):
+        # Full result returned inline
+        for chunk in result.chunks:
+            if chunk.content:
+                chunks.append(chunk.content)
+    elif hasattr(result, "url"):
+        # Large result - fetch from presigned URL
+        print(f"  Fetching result from URL...")
+        resp = requests.get(result.url, timeout=120)
+        resp.raise_for_status()
+        data = resp.json()
+        for chunk in data.get("chunks", []):
+            content = chunk.get("content", "")
+            if content:
+                chunks.append(content)
+
+    # Combine all text
+    full_text = "\n\n".join(chunks)
+
+    if not full_text.strip():
+        raise ValueError("No text content extracted from PDF")
+
+    # Build result
+    return {
+        "full_text": full_text,
+        "pages": chunks,  # Each chunk typically represents content
+        "page_count": len(chunks),
+        "tables": [],  # Reducto can extract tables - add if needed
+    }
+
+
+def process_case(case, fs, reducto_client):
+    """Fetch one case's PDF from GridFS and extract its text.
+
+    Runs on a worker thread; the caller writes the returned update.
+
+    Returns:
+        tuple: (UpdateOne for the case, True if extraction succeeded)
+    """
+    filename = case["filename"]
+    pdf_id = case["pdf_id"]
+    case_id = case["_id"]
 
     try:
-        # Step 1: Upload to Reducto
-        print(f"  Uploading to Reducto...")
-        upload_result = reducto_client.upload(file=tmp_path)
-
-        # Step 2: Parse the uploaded file
-        print(f"  Parsing (file_id: {upload_result.file_id})...")
-        parse_response = reducto_client.parse.run(
-            input=f"reducto://{upload_result.file_id}",
-        )
-
-        result = parse_response.result
-        chunks = []
-
-        # Step 3: Extract chunks (two possible response formats)
-        if hasattr(result, "chunks"):
-            # Full result returned inline
-            for chunk in result.chunks:
-                if chunk.content:
-                    chunks.append(chunk.content)
-        elif hasattr(result, "url"):
-            # Large result - fetch from presigned URL
-            print(f"  Fetching result from URL...")
-            resp = requests.get(result.url, timeout=120)
-            resp.raise_for_status()
-            data = resp.json()
-            for chunk in data.get("chunks", []):
-                content = chunk.get("content", "")
-                if content:
-                    chunks.append(content)
-
-        # Combine all text
-        full_text = "\n\n".join(chunks)
-
-        if not full_text.strip():
-            raise ValueError("No text content extracted from PDF")
-
-        # Build result
-        return {
-            "full_text": full_text,
-            "pages": chunks,  # Each chunk typically represents content
-            "page_count": len(chunks),
-            "tables": [],  # Reducto can extract tables - add if needed
+        # Fetch PDF from GridFS
+        print(f"\n{filename}")
+        print(f"  Fetching from GridFS (pdf_id: {pdf_id})...")
+
+        # Stream GridFS chunks into the upload rather than reading the whole PDF
+        with fs.open_download_stream(pdf_id) as pdf_stream:
+            # Extract text using Reducto
+            extracted_data = extract_text_from_pdf(pdf_stream, filename, reducto_client)
+
+        # Update MongoDB case
+        update_data = {
+            "full_text": extracted_data["full_text"],
+            "pages": extracted_data["pages"],
+            "page_count": extracted_data["page_count"],
+            "tables": extracted_data.get("tables", []),
+            "status": "text_extracted",
+            "extracted_at": datetime.utcnow()
         }
 
-    finally:
-        # Clean up temp file
-        try:
-            tmp_path.unlink()
-        except OSError:
-            pass
+        text_length = len(extracted_data["full_text"])
+        print(f"  ✓ {filename}: extracted {text_length} chars, {extracted_data['page_count']} pages")
+
+        return UpdateOne({"_id": case_id}, {"$set": update_data}), True
+
+    except Exception as e:
+        # Mark as failed and continue
+        error_msg = str(e)
+        print(f"  ✗ {filename}: ERROR: {error_msg}")
+
+        return UpdateOne(
+            {"_id": case_id},
+            {"$set": {
+                "status": "extraction_failed",
+                "error": error_msg,
+                "failed_at": datetime.utcnow()
+            }}
+        ), False
 
 
 def main():
@@ -104,18 +145,18 @@ def main():
 
     # Connect to MongoDB
     print(f"\nConnecting to MongoDB...")
-    client = MongoClient(MONGODB_URI)
+    client = get_client()
     db = client[DATABASE_NAME]
-    fs = GridFS(db)
+    fs = GridFSBucket(db)
     cases_collection = db["cases"]
+    ensure_case_indexes(cases_collection)
 
     # Initialize Reducto client
     reducto_client = Reducto(api_key=REDUCTO_API_KEY)
 
     # Get all cases that need text extraction
     query = {"status": "uploaded"}
-    cases_to_process = list(cases_collection.find(query))
-    total_cases = len(cases_to_process)
+    total_cases = cases_collection.count_documents(query)
 
     if total_cases == 0:
         print("\n✓ No cases found with status='uploaded'")
@@ -128,67 +169,33 @@ def main():
 
     succeeded = 0
     failed = 0
+    pending = []
 
-    # Process each case
-    for idx, case in enumerate(tqdm(cases_to_process, desc="Processing PDFs"), 1):
-        filename = case["filename"]
-        pdf_id = case["pdf_id"]
-        case_id = case["_id"]
-
-        try:
-            # Fetch PDF from GridFS
-            print(f"\n[{idx}/{total_cases}] {filename}")
-            print(f"  Fetching from GridFS (pdf_id: {pdf_id})...")
+    def flush():
+        if pending:
+            cases_collection.bulk_write(pending, ordered=False)
+            pending.clear()
 
-            pdf_file = fs.get(pdf_id)
-            pdf_bytes = pdf_file.read()
-
-            # Extract text using Reducto
-            extracted_data = extract_text_from_pdf(pdf_bytes, filename, reducto_client)
-
-            # Update MongoDB case
-            update_data = {
-                "full_text": extracted_data["full_text"],
-                "pages": extracted_data["pages"],
-                "page_count": extracted_data["page_count"],
-                "tables": extracted_data.get("tables", []),
-                "status": "text_extracted",
-                "extracted_at": datetime.utcnow()
-            }
-
-            cases_collection.update_one(
-                {"_id": case_id},
-                {"$set": update_data}
-            )
-
-            text_length = len(extracted_data["full_text"])
-            print(f"  ✓ Extracted {text_length} chars, {extracted_data['page_count']} pages")
-
-            succeeded += 1
-
-            # Rate limiting
-            if idx < total_cases:
-                time.sleep(DELAY_BETWEEN_CALLS)
-
-        except Exception as e:
-            # Mark as failed and continue
-            error_msg = str(e)
-            print(f"  ✗ ERROR: {error_msg}")
-
-            cases_collection.update_one(
-                {"_id": case_id},
-                {"$set": {
-                    "status": "extraction_failed",
-                    "error": error_msg,
-                    "failed_at": datetime.utcnow()
-                }}
-            )
-
-            failed += 1
-
-            # Continue processing
-            if idx < total_cases:
-                time.sleep(DELAY_BETWEEN_CALLS)
+    # Fan cases out to worker threads; their updates are buffered here
+    cursor = cases_collection.find(query, {"_id": 1, "filename": 1, "pdf_id": 1})
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    try:
+        futures = [executor.submit(process_case, case, fs, reducto_client) for case in cursor]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing PDFs"):
+            update, ok = future.result()
+            pending.append(update)
+            if ok:
+                succeeded += 1
+            else:
+                failed += 1
+
+            if len(pending) >= BULK_WRITE_SIZE:
+                flush()
+    finally:
+        # Drop queued work on interrupt; those cases stay 'uploaded' for the next run
+        executor.shutdown(cancel_futures=True)
+        # Persist whatever is buffered, even if the run is interrupted
+        flush()
 
     # Summary
     print("\n" + "=" * 70)
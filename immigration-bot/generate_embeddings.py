@@ -2,17 +2,16 @@
 
 import os
 import time
-from pathlib import Path
 from datetime import datetime
-from dotenv import load_dotenv
 
-from pymongo import MongoClient
 import voyageai
 from tqdm import tqdm
 
+from _env import load_env
+from db import get_client, ensure_case_indexes
+
 # Load environment variables
-env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(env_path)
+env_path = load_env()
 
 MONGODB_URI = os.environ.get("MONGODB_URI")
 VOYAGE_API_KEY = os.environ.get("VOYAGE_API_KEY")
@@ -81,9 +80,10 @@ def main():
 
     # Connect to MongoDB
     print(f"\nConnecting to MongoDB...")
-    client = MongoClient(MONGODB_URI)
+    client = get_client()
     db = client[DATABASE_NAME]
     cases_collection = db["cases"]
+    ensure_case_indexes(cases_collection)
 
     # Initialize Voyage AI client
     voyage_client = voyageai.Client(api_key=VOYAGE_API_KEY)
@@ -201,7 +201,10 @@ def main():
         print("\n" + "-" * 80)
         print("SAMPLE EMBEDDING INFO:")
         print("-" * 80)
-        sample = cases_collection.find_one({"status": "embedded"})
+        sample = cases_collection.find_one({"status": "embedded"}, {
+            "_id": 0, "filename": 1, "embedding_model": 1, "embedding_dimensions": 1,
+            "embedded_at": 1, "embedding": {"$slice": 10},
+        })
         if sample:
             print(f"\nFilename: {sample.get('filename')}")
             print(f"Embedding model: {sample.get('embedding_model')}")
@@ -1,18 +1,29 @@
 """Generate embeddings for all cases using OpenAI."""
 
 import os
+import json
+import hashlib
 import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime
-from dotenv import load_dotenv
+from itertools import islice
 
-from pymongo import MongoClient
-from openai import OpenAI
+import numpy as np
+import tiktoken
+from bson import Binary, ObjectId
+from pymongo import UpdateOne
+from openai import OpenAI, BadRequestError, RateLimitError
 from tqdm import tqdm
 
+from _env import load_env
+from db import get_client, ensure_case_indexes, status_counts
+from rate_limit import TokenBucket
+
 # Load environment variables
-env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(env_path)
+env_path = load_env()
 
 MONGODB_URI = os.environ.get("MONGODB_URI")
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
@@ -24,29 +35,95 @@ if not MONGODB_URI or not OPENAI_API_KEY:
     )
 
 DATABASE_NAME = "rfe_tool"
-DELAY_BETWEEN_CALLS = 0.5  # seconds
+# Texts per embeddings request; at most MAX_INPUT_TOKENS each, this stays
+# under the API's 300k-tokens-per-request cap
+BATCH_SIZE = 32
+MAX_WORKERS = 8  # embedding requests in flight
+# Account tokens- and requests-per-minute limits for the embedding model (vary by tier)
+TOKENS_PER_MINUTE = int(os.environ.get("OPENAI_EMBEDDING_TPM", 1_000_000))
+REQUESTS_PER_MINUTE = int(os.environ.get("OPENAI_EMBEDDING_RPM", 3_000))
+BATCH_POLL_INTERVAL = 60  # seconds between Batch API status checks
+BULK_WRITE_SIZE = 500  # case updates per MongoDB bulk_write (max 1000 per batch)
+LOAD_BATCH_SIZE = 200  # cases hashed and checked against the cache per cursor batch
 MODEL = "text-embedding-3-large"  # 3072 dimensions, best quality
 # Alternative: "text-embedding-3-small" (1536 dims, faster/cheaper)
+MAX_INPUT_TOKENS = 8191  # per-input limit for OpenAI embedding models
+ENCODING = tiktoken.encoding_for_model(MODEL)
+
+
+def clip_text(text):
+    """Clip text to the embedding model's input limit.
+
+    Returns:
+        tuple: (clipped text, its token count)
+    """
+    tokens = ENCODING.encode(text, disallowed_special=())
+    if len(tokens) > MAX_INPUT_TOKENS:
+        return ENCODING.decode(tokens[:MAX_INPUT_TOKENS]), MAX_INPUT_TOKENS
+    return text, len(tokens)
+
+
+def truncate_text(text):
+    """Clip text to the embedding model's input limit."""
+    return clip_text(text)[0]
+
+
+def text_hash(text):
+    """Cache key for the text actually sent to the model."""
+    return hashlib.sha256(truncate_text(text).encode("utf-8")).hexdigest()
+
+
+def embedded_fields(embedding):
+    """Fields set on a case once its embedding is stored.
+
+    embedding_bin holds the unit-normalised vector as packed float32 so
+    the graph build can read it straight into numpy.
+    """
+    unit = np.asarray(embedding, dtype=np.float32)
+    unit /= np.linalg.norm(unit) or 1.0
+    return {
+        "embedding": embedding,
+        "embedding_bin": Binary(unit.tobytes()),
+        "embedding_model": MODEL,
+        "embedding_dimensions": len(embedding),
+        "status": "embedded",
+        "embedded_at": datetime.utcnow()
+    }
+
+
+def cache_upsert(text_hash_value, embedding):
+    """Upsert op storing an embedding in the embedding_cache collection."""
+    return UpdateOne(
+        {"hash": text_hash_value, "model": MODEL},
+        {"$setOnInsert": {"embedding": embedding, "created_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+
+def check_dimensions(embedding):
+    """Raise if an embedding doesn't have the model's dimensionality."""
+    expected_dims = 3072 if "large" in MODEL else 1536
+    if len(embedding) != expected_dims:
+        raise ValueError(f"Expected {expected_dims} dimensions, got {len(embedding)}")
 
 
-def generate_embedding(text, openai_client, max_retries=2):
+def generate_embedding(text, openai_client, max_retries=2, bucket=None):
     """Generate embedding for text using OpenAI.
 
     Args:
         text: Input text to embed
         openai_client: OpenAI client instance
         max_retries: Number of retry attempts
+        bucket: Optional TokenBucket to draw the request's tokens from
 
     Returns:
         list: Embedding vector or None if failed
     """
+    text, n_tokens = clip_text(text)
     for attempt in range(max_retries):
         try:
-            # OpenAI has 8191 token limit for embeddings
-            # Roughly 1 token = 4 chars, so limit to ~30k chars
-            max_chars = 30000
-            if len(text) > max_chars:
-                text = text[:max_chars]
+            if bucket is not None:
+                bucket.acquire(n_tokens)
 
             response = openai_client.embeddings.create(
                 model=MODEL,
@@ -54,14 +131,20 @@ def generate_embedding(text, openai_client, max_retries=2):
             )
 
             embedding = response.data[0].embedding
-
-            # Verify embedding dimensions
-            expected_dims = 3072 if "large" in MODEL else 1536
-            if len(embedding) != expected_dims:
-                raise ValueError(f"Expected {expected_dims} dimensions, got {len(embedding)}")
+            check_dimensions(embedding)
 
             return embedding
 
+        except RateLimitError as e:
+            if bucket is not None:
+                bucket.release(n_tokens)
+            if attempt < max_retries - 1:
+                print(f"    ⚠️  Rate limited (attempt {attempt + 1}/{max_retries}): {e}")
+                time.sleep(2)
+                continue
+            print(f"    ❌ Failed after {max_retries} attempts: {e}")
+            return None
+
         except Exception as e:
             if attempt < max_retries - 1:
                 print(f"    ⚠️  OpenAI API error (attempt {attempt + 1}/{max_retries}): {e}")
@@ -74,26 +157,309 @@ def generate_embedding(text, openai_client, max_retries=2):
     return None
 
 
+def generate_embeddings_batch(texts, openai_client, bucket=None, max_retries=3):
+    """Generate embeddings for several texts with a single OpenAI request.
+
+    If the request is rejected outright (e.g. one text exceeds the context
+    length), each text is retried on its own so only the offending one fails.
+
+    Args:
+        texts: Input texts to embed
+        openai_client: OpenAI client instance
+        bucket: Optional TokenBucket to draw the request's tokens from
+        max_retries: Number of retry attempts
+
+    Returns:
+        list: Embedding vectors in input order (None for any that failed)
+    """
+    clipped = [clip_text(t) for t in texts]
+    inputs = [t for t, _ in clipped]
+    n_tokens = sum(n for _, n in clipped)  # charged against the token bucket
+
+    for attempt in range(max_retries):
+        try:
+            if bucket is not None:
+                bucket.acquire(n_tokens)
+
+            response = openai_client.embeddings.create(
+                model=MODEL,
+                input=inputs
+            )
+
+            embeddings = [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+            for embedding in embeddings:
+                check_dimensions(embedding)
+
+            return embeddings
+
+        except BadRequestError as e:
+            print(f"    ⚠️  Batch rejected ({e}); embedding texts individually")
+            return [generate_embedding(t, openai_client, bucket=bucket) for t in texts]
+
+        except RateLimitError as e:
+            # The request was rejected, so its tokens were never spent
+            if bucket is not None:
+                bucket.release(n_tokens)
+            if attempt < max_retries - 1:
+                delay = 2 ** (attempt + 1)
+                print(f"    ⚠️  Rate limited (attempt {attempt + 1}/{max_retries}), backing off {delay}s")
+                time.sleep(delay)
+                continue
+            print(f"    ❌ Still rate limited after {max_retries} attempts: {e}")
+            return [None] * len(texts)
+
+        except Exception as e:
+            if attempt < max_retries - 1:
+                print(f"    ⚠️  OpenAI API error (attempt {attempt + 1}/{max_retries}): {e}")
+                time.sleep(2)
+                continue
+            else:
+                print(f"    ❌ Failed after {max_retries} attempts: {e}")
+                return [None] * len(texts)
+
+    return [None] * len(texts)
+
+
+def fetch_texts(cases_collection, cases):
+    """Fetch full_text for a batch of cases in one query, in the batch's order."""
+    docs = cases_collection.find({"_id": {"$in": [c["_id"] for c in cases]}}, {"full_text": 1})
+    texts = {d["_id"]: d.get("full_text") or "" for d in docs}
+    return [texts.get(c["_id"], "") for c in cases]
+
+
+def run_interactive(cases, cases_collection, cache_collection, openai_client):
+    """Embed cases through the regular embeddings endpoint.
+
+    Up to MAX_WORKERS batch requests are in flight at once, paced by a token
+    bucket sized to TOKENS_PER_MINUTE and REQUESTS_PER_MINUTE. Each worker
+    fetches its batch's full_text itself, so only the in-flight batches' text
+    is held in memory. Results are matched back to cases by their MongoDB
+    _id, so completion order doesn't matter.
+
+    Returns:
+        dict with keys: succeeded, failed
+    """
+    stats = {"succeeded": 0, "failed": 0}
+    bucket = TokenBucket(TOKENS_PER_MINUTE, REQUESTS_PER_MINUTE)
+
+    to_embed = []
+    for case in cases:
+        if case["text_hash"]:
+            to_embed.append(case)
+        else:
+            print(f"  ❌ No full_text found: {case['filename']}")
+            stats["failed"] += 1
+
+    batches = [to_embed[i:i + BATCH_SIZE] for i in range(0, len(to_embed), BATCH_SIZE)]
+    pending = []
+
+    def embed_batch(batch):
+        return generate_embeddings_batch(fetch_texts(cases_collection, batch), openai_client, bucket)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(embed_batch, batch): batch for batch in batches}
+
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Generating embeddings"):
+            batch = futures[future]
+            embeddings = future.result()
+
+            cache_ops = [cache_upsert(c["text_hash"], e) for c, e in zip(batch, embeddings) if e is not None]
+            if cache_ops:
+                cache_collection.bulk_write(cache_ops, ordered=False)
+
+            for case, embedding in zip(batch, embeddings):
+                case_id = case["_id"]
+                if embedding is None:
+                    # Mark as failed
+                    pending.append(UpdateOne(
+                        {"_id": case_id},
+                        {"$set": {
+                            "status": "embedding_failed",
+                            "embedding_failed_at": datetime.utcnow()
+                        }}
+                    ))
+                    stats["failed"] += 1
+                    continue
+
+                # Update MongoDB with embedding
+                pending.append(UpdateOne(
+                    {"_id": case_id},
+                    {"$set": embedded_fields(embedding)}
+                ))
+
+                stats["succeeded"] += 1
+
+            if len(pending) >= BULK_WRITE_SIZE:
+                cases_collection.bulk_write(pending, ordered=False)
+                pending = []
+
+    if pending:
+        cases_collection.bulk_write(pending, ordered=False)
+
+    return stats
+
+
+def run_batch(cases, cases_collection, cache_collection, openai_client):
+    """Embed cases through the OpenAI Batch API.
+
+    Half the price of interactive calls and not subject to per-minute rate
+    limits, at the cost of up to 24h turnaround; meant for large backfills.
+    Requests that the batch reports as errored keep status='features_extracted'
+    so they are retried on the next run.
+
+    Returns:
+        dict with keys: succeeded, failed
+    """
+    stats = {"succeeded": 0, "failed": 0}
+    hashes = {}  # custom_id -> text hash, for caching results
+
+    to_embed = []
+    for case in cases:
+        if case["text_hash"]:
+            to_embed.append(case)
+        else:
+            print(f"  ❌ No full_text found: {case['filename']}")
+            stats["failed"] += 1
+
+    # Step 1: Write one embeddings request per case to a JSONL file,
+    # fetching full_text a batch at a time
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as tmp:
+        for i in range(0, len(to_embed), BATCH_SIZE):
+            batch = to_embed[i:i + BATCH_SIZE]
+            for case, text in zip(batch, fetch_texts(cases_collection, batch)):
+                hashes[str(case["_id"])] = case["text_hash"]
+                tmp.write(json.dumps({
+                    "custom_id": str(case["_id"]),
+                    "method": "POST",
+                    "url": "/v1/embeddings",
+                    "body": {"model": MODEL, "input": truncate_text(text)},
+                }) + "\n")
+        tmp_path = Path(tmp.name)
+
+    # Step 2: Upload the requests and start the batch
+    try:
+        with open(tmp_path, "rb") as f:
+            input_file = openai_client.files.create(file=f, purpose="batch")
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    batch = openai_client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/embeddings",
+        completion_window="24h",
+    )
+    print(f"  Submitted batch {batch.id}")
+
+    # Step 3: Poll until the batch reaches a terminal state
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(BATCH_POLL_INTERVAL)
+        batch = openai_client.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        done = f" ({counts.completed}/{counts.total})" if counts else ""
+        print(f"  Batch status: {batch.status}{done}")
+
+    if not batch.output_file_id:
+        print(f"  ❌ Batch {batch.id} ended with status '{batch.status}' and no output")
+        return stats
+
+    # Step 4: Stream the (large) output file and apply results in bulk
+    ops = []
+    cache_ops = []
+    with openai_client.files.with_streaming_response.content(batch.output_file_id) as output:
+        for line in output.iter_lines():
+            if not line:
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            case_id = ObjectId(result["custom_id"])
+
+            embedding = None
+            if response.get("status_code") == 200:
+                embedding = response["body"]["data"][0]["embedding"]
+
+            if embedding is None:
+                update_data = {"status": "embedding_failed", "embedding_failed_at": datetime.utcnow()}
+                stats["failed"] += 1
+            else:
+                update_data = embedded_fields(embedding)
+                cache_ops.append(cache_upsert(hashes[result["custom_id"]], embedding))
+                stats["succeeded"] += 1
+
+            ops.append(UpdateOne({"_id": case_id}, {"$set": update_data}))
+            if len(ops) >= BULK_WRITE_SIZE:
+                cases_collection.bulk_write(ops, ordered=False)
+                ops = []
+            if len(cache_ops) >= BULK_WRITE_SIZE:
+                cache_collection.bulk_write(cache_ops, ordered=False)
+                cache_ops = []
+
+    if ops:
+        cases_collection.bulk_write(ops, ordered=False)
+    if cache_ops:
+        cache_collection.bulk_write(cache_ops, ordered=False)
+
+    return stats
+
+
 def main():
     """Main embedding generation pipeline."""
 
+    parser = argparse.ArgumentParser(description="Generate OpenAI embeddings for cases")
+    parser.add_argument("--mode", choices=["interactive", "batch"], default="interactive",
+                        help="'batch' submits through the OpenAI Batch API "
+                             "(half price, up to 24h turnaround; best for large backfills)")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print a sample embedded case after the run")
+    args = parser.parse_args()
+
     print("=" * 80)
     print("OPENAI EMBEDDING GENERATION PIPELINE")
     print("=" * 80)
 
     # Connect to MongoDB
     print(f"\nConnecting to MongoDB...")
-    client = MongoClient(MONGODB_URI)
+    client = get_client()
     db = client[DATABASE_NAME]
     cases_collection = db["cases"]
+    ensure_case_indexes(cases_collection)
 
     # Initialize OpenAI client
     openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
-    # Get all cases that need embeddings
+    # Reuse embeddings already computed for identical text (re-runs, re-uploads)
+    cache_collection = db["embedding_cache"]
+    cache_collection.create_index([("hash", 1), ("model", 1)], unique=True)
+
+    # Get all cases that need embeddings. Each cursor batch is hashed and
+    # checked against the cache, then its full_text is dropped; only _id,
+    # filename and text_hash are kept, and the embed step refetches text
+    # per request batch
     query = {"status": "features_extracted"}
-    cases_to_process = list(cases_collection.find(query))
-    total_cases = len(cases_to_process)
+    cursor = cases_collection.find(query, {"_id": 1, "filename": 1, "full_text": 1}).batch_size(LOAD_BATCH_SIZE)
+    cases_to_process = []
+    total_cases = 0
+    cache_hits = 0
+    progress = tqdm(desc="Loading cases")
+    while chunk := list(islice(cursor, LOAD_BATCH_SIZE)):
+        for case in chunk:
+            text = case.pop("full_text", None)
+            case["text_hash"] = text_hash(text) if text else None
+        hashes = list({c["text_hash"] for c in chunk if c["text_hash"]})
+        cached = {
+            d["hash"]: d["embedding"]
+            for d in cache_collection.find({"hash": {"$in": hashes}, "model": MODEL}, {"hash": 1, "embedding": 1})
+        }
+        hits = [c for c in chunk if c["text_hash"] in cached]
+        if hits:
+            cases_collection.bulk_write([
+                UpdateOne({"_id": c["_id"]}, {"$set": embedded_fields(cached[c["text_hash"]])})
+                for c in hits
+            ], ordered=False)
+        cases_to_process.extend(c for c in chunk if c["text_hash"] not in cached)
+        total_cases += len(chunk)
+        cache_hits += len(hits)
+        progress.update(len(chunk))
+    progress.close()
 
     if total_cases == 0:
         print("\n✓ No cases found with status='features_extracted'")
@@ -101,8 +467,9 @@ def main():
 
         # Check what statuses we have
         print("\nCurrent status distribution:")
+        counts = status_counts(cases_collection)
         for status in ["embedded", "features_extracted", "text_extracted", "uploaded"]:
-            count = cases_collection.count_documents({"status": status})
+            count = counts.get(status, 0)
             if count > 0:
                 print(f"  - {status}: {count}")
 
@@ -112,80 +479,18 @@ def main():
     dims = 3072 if "large" in MODEL else 1536
     print(f"\nFound {total_cases} cases to process")
     print(f"Using model: {MODEL} ({dims} dimensions)")
+    print(f"Mode: {args.mode}")
     print("\n" + "-" * 80)
 
-    succeeded = 0
-    failed = 0
-
-    # Process each case
-    for idx, case in enumerate(tqdm(cases_to_process, desc="Generating embeddings"), 1):
-        filename = case["filename"]
-        case_id = case["_id"]
-        full_text = case.get("full_text", "")
-
-        if not full_text:
-            print(f"\n[{idx}/{total_cases}] {filename}")
-            print(f"  ❌ No full_text found")
-            failed += 1
-            continue
-
-        try:
-            print(f"\n[{idx}/{total_cases}] {filename}")
-            print(f"  Text length: {len(full_text)} chars")
-
-            # Generate embedding with OpenAI
-            embedding = generate_embedding(full_text, openai_client)
-
-            if embedding is None:
-                # Mark as failed
-                cases_collection.update_one(
-                    {"_id": case_id},
-                    {"$set": {
-                        "status": "embedding_failed",
-                        "embedding_failed_at": datetime.utcnow()
-                    }}
-                )
-                failed += 1
-                continue
-
-            # Update MongoDB with embedding
-            update_data = {
-                "embedding": embedding,
-                "embedding_model": MODEL,
-                "embedding_dimensions": len(embedding),
-                "status": "embedded",
-                "embedded_at": datetime.utcnow()
-            }
-
-            cases_collection.update_one(
-                {"_id": case_id},
-                {"$set": update_data}
-            )
-
-            print(f"  ✓ Embedded ({len(embedding)} dims)")
-
-            succeeded += 1
-
-            # Rate limiting
-            if idx < total_cases:
-                time.sleep(DELAY_BETWEEN_CALLS)
-
-        except Exception as e:
-            print(f"  ❌ Unexpected error: {e}")
-
-            cases_collection.update_one(
-                {"_id": case_id},
-                {"$set": {
-                    "status": "embedding_failed",
-                    "error": str(e),
-                    "embedding_failed_at": datetime.utcnow()
-                }}
-            )
-
-            failed += 1
+    if cache_hits:
+        print(f"✓ Reused cached embeddings for {cache_hits} cases")
 
-            if idx < total_cases:
-                time.sleep(DELAY_BETWEEN_CALLS)
+    if args.mode == "batch":
+        stats = run_batch(cases_to_process, cases_collection, cache_collection, openai_client)
+    else:
+        stats = run_interactive(cases_to_process, cases_collection, cache_collection, openai_client)
+    succeeded = stats["succeeded"] + cache_hits
+    failed = stats["failed"]
 
     # Summary
     print("\n" + "=" * 80)
@@ -195,16 +500,20 @@ def main():
     print(f"✓ Succeeded: {succeeded}")
     print(f"❌ Failed: {failed}")
     print("\nUpdated status in MongoDB:")
-    print(f"  - embedded: {cases_collection.count_documents({'status': 'embedded'})}")
-    print(f"  - embedding_failed: {cases_collection.count_documents({'status': 'embedding_failed'})}")
-    print(f"  - features_extracted (pending): {cases_collection.count_documents({'status': 'features_extracted'})}")
+    counts = status_counts(cases_collection)
+    print(f"  - embedded: {counts.get('embedded', 0)}")
+    print(f"  - embedding_failed: {counts.get('embedding_failed', 0)}")
+    print(f"  - features_extracted (pending): {counts.get('features_extracted', 0)}")
 
     # Show sample embedding info
-    if succeeded > 0:
+    if args.verbose and succeeded > 0:
         print("\n" + "-" * 80)
         print("SAMPLE EMBEDDING INFO:")
         print("-" * 80)
-        sample = cases_collection.find_one({"status": "embedded"})
+        sample = cases_collection.find_one({"status": "embedded"}, {
+            "_id": 0, "filename": 1, "embedding_model": 1, "embedding_dimensions": 1,
+            "embedded_at": 1, "embedding": {"$slice": 10},
+        })
         if sample:
             print(f"\nFilename: {sample.get('filename')}")
             print(f"Embedding model: {sample.get('embedding_model')}")
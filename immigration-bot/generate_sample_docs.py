@@ -1,5 +1,6 @@
 """Generate sample RFE and Profile PDFs for the demo flow."""
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from fpdf import FPDF
 
@@ -7,6 +8,15 @@ SAMPLE_DIR = Path(__file__).parent / "sample_docs"
 SAMPLE_DIR.mkdir(exist_ok=True)
 
 
+def kv_rows(pdf, rows):
+    """Write (label, value) pairs as bold-label / plain-value lines."""
+    for label, value in rows:
+        pdf.set_font("Helvetica", "B", 11)
+        pdf.cell(50, 7, f"{label}:", ln=False)
+        pdf.set_font("Helvetica", "", 11)
+        pdf.cell(0, 7, value, ln=True)
+
+
 def generate_rfe_pdf():
     pdf = FPDF()
     pdf.add_page()
@@ -25,30 +35,13 @@ def generate_rfe_pdf():
     pdf.ln(6)
 
     # Case info
-    pdf.set_font("Helvetica", "B", 11)
-    pdf.cell(50, 7, "Receipt Number:", ln=False)
-    pdf.set_font("Helvetica", "", 11)
-    pdf.cell(0, 7, "WAC-25-123-45678", ln=True)
-
-    pdf.set_font("Helvetica", "B", 11)
-    pdf.cell(50, 7, "Beneficiary:", ln=False)
-    pdf.set_font("Helvetica", "", 11)
-    pdf.cell(0, 7, "McLovin", ln=True)
-
-    pdf.set_font("Helvetica", "B", 11)
-    pdf.cell(50, 7, "Petitioner:", ln=False)
-    pdf.set_font("Helvetica", "", 11)
-    pdf.cell(0, 7, "Pumpkin Tech Consulting LLC", ln=True)
-
-    pdf.set_font("Helvetica", "B", 11)
-    pdf.cell(50, 7, "Classification:", ln=False)
-    pdf.set_font("Helvetica", "", 11)
-    pdf.cell(0, 7, "H-1B Specialty Occupation (INA 101(a)(15)(H)(i)(b))", ln=True)
-
-    pdf.set_font("Helvetica", "B", 11)
-    pdf.cell(50, 7, "Service Center:", ln=False)
-    pdf.set_font("Helvetica", "", 11)
-    pdf.cell(0, 7, "California Service Center", ln=True)
+    kv_rows(pdf, [
+        ("Receipt Number", "WAC-25-123-45678"),
+        ("Beneficiary", "McLovin"),
+        ("Petitioner", "Pumpkin Tech Consulting LLC"),
+        ("Classification", "H-1B Specialty Occupation (INA 101(a)(15)(H)(i)(b))"),
+        ("Service Center", "California Service Center"),
+    ])
 
     pdf.ln(6)
     pdf.line(10, pdf.get_y(), 200, pdf.get_y())
@@ -83,20 +76,11 @@ def generate_rfe_pdf():
     pdf.cell(0, 8, "Additional Information", ln=True)
     pdf.ln(2)
 
-    pdf.set_font("Helvetica", "B", 11)
-    pdf.cell(50, 7, "Wage Level:", ln=False)
-    pdf.set_font("Helvetica", "", 11)
-    pdf.cell(0, 7, "Level I ($73,000/year)", ln=True)
-
-    pdf.set_font("Helvetica", "B", 11)
-    pdf.cell(50, 7, "SOC Code:", ln=False)
-    pdf.set_font("Helvetica", "", 11)
-    pdf.cell(0, 7, "15-1252.00 (Software Developers)", ln=True)
-
-    pdf.set_font("Helvetica", "B", 11)
-    pdf.cell(50, 7, "Response Due:", ln=False)
-    pdf.set_font("Helvetica", "", 11)
-    pdf.cell(0, 7, "84 days from date of this notice", ln=True)
+    kv_rows(pdf, [
+        ("Wage Level", "Level I ($73,000/year)"),
+        ("SOC Code", "15-1252.00 (Software Developers)"),
+        ("Response Due", "84 days from date of this notice"),
+    ])
 
     out_path = SAMPLE_DIR / "mclovin_rfe.pdf"
     pdf.output(str(out_path))
@@ -128,11 +112,7 @@ def generate_profile_pdf():
         ("Phone", "808-555-0123"),
         ("Address", "892 Momona St, Honolulu, HI 96820"),
     ]
-    for label, value in fields:
-        pdf.set_font("Helvetica", "B", 11)
-        pdf.cell(50, 7, f"{label}:", ln=False)
-        pdf.set_font("Helvetica", "", 11)
-        pdf.cell(0, 7, value, ln=True)
+    kv_rows(pdf, fields)
 
     pdf.ln(6)
 
@@ -148,11 +128,7 @@ def generate_profile_pdf():
         ("Wage Level", "Level I"),
         ("Years of Experience", "2"),
     ]
-    for label, value in emp_fields:
-        pdf.set_font("Helvetica", "B", 11)
-        pdf.cell(50, 7, f"{label}:", ln=False)
-        pdf.set_font("Helvetica", "", 11)
-        pdf.cell(0, 7, value, ln=True)
+    kv_rows(pdf, emp_fields)
 
     pdf.ln(6)
 
@@ -161,20 +137,11 @@ def generate_profile_pdf():
     pdf.cell(0, 9, "Education", ln=True)
     pdf.ln(2)
 
-    pdf.set_font("Helvetica", "B", 11)
-    pdf.cell(50, 7, "Degree:", ln=False)
-    pdf.set_font("Helvetica", "", 11)
-    pdf.cell(0, 7, "B.S. Computer Science", ln=True)
-
-    pdf.set_font("Helvetica", "B", 11)
-    pdf.cell(50, 7, "University:", ln=False)
-    pdf.set_font("Helvetica", "", 11)
-    pdf.cell(0, 7, "University of Hawaii at Manoa", ln=True)
-
-    pdf.set_font("Helvetica", "B", 11)
-    pdf.cell(50, 7, "Graduation:", ln=False)
-    pdf.set_font("Helvetica", "", 11)
-    pdf.cell(0, 7, "2022", ln=True)
+    kv_rows(pdf, [
+        ("Degree", "B.S. Computer Science"),
+        ("University", "University of Hawaii at Manoa"),
+        ("Graduation", "2022"),
+    ])
 
     pdf.ln(6)
 
@@ -188,11 +155,7 @@ def generate_profile_pdf():
         ("Current Arguments", "O*NET Citation"),
         ("Filing Status", "Initial H-1B petition"),
     ]
-    for label, value in h1b_fields:
-        pdf.set_font("Helvetica", "B", 11)
-        pdf.cell(50, 7, f"{label}:", ln=False)
-        pdf.set_font("Helvetica", "", 11)
-        pdf.cell(0, 7, value, ln=True)
+    kv_rows(pdf, h1b_fields)
 
     pdf.ln(6)
 
@@ -215,6 +178,8 @@ def generate_profile_pdf():
 
 
 if __name__ == "__main__":
-    generate_rfe_pdf()
-    generate_profile_pdf()
+    # FPDF layout is pure-Python CPU work; build each document in its own process
+    with ProcessPoolExecutor() as executor:
+        for future in [executor.submit(fn) for fn in (generate_rfe_pdf, generate_profile_pdf)]:
+            future.result()
     print("Done! Sample documents generated in sample_docs/")
@@ -1,19 +1,19 @@
 """Generate 2D UMAP coordinates for case visualization."""
 
-import os
 import pickle
+import argparse
 from pathlib import Path
-from dotenv import load_dotenv
 
 import numpy as np
-from pymongo import MongoClient
 import umap
+from pymongo import UpdateOne
+
+from _env import load_env
+from db import get_client, ensure_case_indexes
 
 # Load environment variables
-env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(env_path)
+load_env()
 
-MONGODB_URI = os.environ.get("MONGODB_URI")
 DATABASE_NAME = "rfe_tool"
 
 # UMAP parameters
@@ -21,26 +21,34 @@ UMAP_PARAMS = {
     "n_neighbors": 15,
     "min_dist": 0.1,
     "metric": "cosine",
-    "random_state": 42
+    # No random_state: a fixed seed forces UMAP back to a single thread
+    "n_jobs": -1,
+    "low_memory": True
 }
 
 def main():
     """Main UMAP coordinate generation pipeline."""
 
+    parser = argparse.ArgumentParser(description="Generate 2D UMAP coordinates for cases")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print sample coordinates for the first 10 cases")
+    args = parser.parse_args()
+
     print("=" * 80)
     print("UMAP 2D COORDINATE GENERATION")
     print("=" * 80)
 
     # Connect to MongoDB
     print(f"\nConnecting to MongoDB...")
-    client = MongoClient(MONGODB_URI)
+    client = get_client()
     db = client[DATABASE_NAME]
     cases_collection = db["cases"]
+    ensure_case_indexes(cases_collection)
 
     # Fetch all embedded cases
     print(f"\nFetching cases with embeddings...")
     query = {"status": "embedded", "embedding": {"$exists": True}}
-    cases = list(cases_collection.find(query))
+    cases = list(cases_collection.find(query, {"embedding": 1, "filename": 1}).batch_size(200))
 
     if len(cases) == 0:
         print("\n❌ No cases found with embeddings!")
@@ -53,9 +61,10 @@ def main():
 
     # Extract embeddings and case IDs
     print(f"\nExtracting embeddings into numpy array...")
-    embeddings = np.array([c["embedding"] for c in cases])
+    embeddings = np.array([c.pop("embedding") for c in cases], dtype=np.float32)
     case_ids = [c["_id"] for c in cases]
     filenames = [c.get("filename", "unknown") for c in cases]
+    del cases
 
     print(f"Embedding matrix shape: {embeddings.shape}")
     print(f"Dimensions: {embeddings.shape[1]}")
@@ -76,18 +85,18 @@ def main():
 
     # Update MongoDB with 2D coordinates
     print(f"\nUpdating MongoDB with 2D coordinates...")
-    for i, case_id in enumerate(case_ids):
-        cases_collection.update_one(
+    result = cases_collection.bulk_write([
+        UpdateOne(
             {"_id": case_id},
             {"$set": {
-                "x_2d": float(coords_2d[i, 0]),
-                "y_2d": float(coords_2d[i, 1]),
+                "x_2d": float(x),
+                "y_2d": float(y),
                 "status": "complete"
             }}
         )
-
-        if (i + 1) % 10 == 0 or (i + 1) == total_cases:
-            print(f"  Updated {i + 1}/{total_cases} cases")
+        for case_id, (x, y) in zip(case_ids, coords_2d)
+    ], ordered=False)
+    print(f"  Updated {result.modified_count}/{total_cases} cases")
 
     # Save UMAP model for projecting new cases later
     model_path = Path(__file__).parent / "umap_model.pkl"
@@ -106,17 +115,18 @@ def main():
     print(f"Status updated to: complete")
 
     # Show sample coordinates
-    print("\n" + "-" * 80)
-    print("SAMPLE COORDINATES (first 10 cases):")
-    print("-" * 80)
-    print(f"\n{'Filename':<40} {'X':<12} {'Y':<12}")
-    print("-" * 80)
-
-    for i in range(min(10, total_cases)):
-        filename = filenames[i]
-        x = coords_2d[i, 0]
-        y = coords_2d[i, 1]
-        print(f"{filename:<40} {x:>11.4f} {y:>11.4f}")
+    if args.verbose:
+        print("\n" + "-" * 80)
+        print("SAMPLE COORDINATES (first 10 cases):")
+        print("-" * 80)
+        print(f"\n{'Filename':<40} {'X':<12} {'Y':<12}")
+        print("-" * 80)
+
+        for i in range(min(10, total_cases)):
+            filename = filenames[i]
+            x = coords_2d[i, 0]
+            y = coords_2d[i, 1]
+            print(f"{filename:<40} {x:>11.4f} {y:>11.4f}")
 
     # Distribution stats
     print("\n" + "-" * 80)
@@ -129,11 +139,17 @@ def main():
     print("\n" + "-" * 80)
     print("MONGODB VERIFICATION:")
     print("-" * 80)
-    complete_count = cases_collection.count_documents({"status": "complete"})
-    with_coords = cases_collection.count_documents({
-        "x_2d": {"$exists": True},
-        "y_2d": {"$exists": True}
-    })
+    has_coords = {"$and": [
+        {"$ne": [{"$type": "$x_2d"}, "missing"]},
+        {"$ne": [{"$type": "$y_2d"}, "missing"]},
+    ]}
+    verification = next(cases_collection.aggregate([{"$group": {
+        "_id": None,
+        "complete": {"$sum": {"$cond": [{"$eq": ["$status", "complete"]}, 1, 0]}},
+        "with_coords": {"$sum": {"$cond": [has_coords, 1, 0]}},
+    }}]), {})
+    complete_count = verification.get("complete", 0)
+    with_coords = verification.get("with_coords", 0)
 
     print(f"Cases with status='complete': {complete_count}")
     print(f"Cases with x_2d, y_2d coordinates: {with_coords}")
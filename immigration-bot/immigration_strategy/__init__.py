@@ -1,5 +1,12 @@
 """H-1B AAO Appeal Strategy Recommendation System."""
 
-from .strategy_engine import RecommendationEngine
-
 __all__ = ["RecommendationEngine"]
+
+
+def __getattr__(name):
+    # Deferred so `python -m immigration_strategy.main --help` skips the
+    # numpy/networkx/pymongo imports
+    if name == "RecommendationEngine":
+        from .strategy_engine import RecommendationEngine
+        return RecommendationEngine
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
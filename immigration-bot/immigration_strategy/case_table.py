@@ -0,0 +1,57 @@
+"""Columnar view of the case list for vectorised scoring and analysis."""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class CaseTable:
+    """Case fields as columns: NumPy arrays for scalars, lists for label lists.
+
+    Missing strings are stored as "" and outcomes are upper-cased. Row i
+    is self.cases[i], so any case dict carrying "index" maps straight to
+    a row.
+    """
+
+    outcomes: np.ndarray
+    job_titles: np.ndarray
+    company_types: np.ndarray
+    wage_levels: np.ndarray
+    x_2d: np.ndarray
+    y_2d: np.ndarray
+    arguments_made: list
+    argument_combos: list
+    rfe_issues: list
+    cases: list
+
+    @classmethod
+    def from_cases(cls, cases):
+        def column(field):
+            return np.array([c.get(field) or "" for c in cases], dtype=str)
+
+        arguments_made = [c.get("arguments_made") or [] for c in cases]
+        return cls(
+            outcomes=np.char.upper(column("outcome")),
+            job_titles=column("job_title"),
+            company_types=column("company_type"),
+            wage_levels=column("wage_level"),
+            x_2d=np.array([c.get("x_2d") or 0.0 for c in cases], dtype=np.float64),
+            y_2d=np.array([c.get("y_2d") or 0.0 for c in cases], dtype=np.float64),
+            arguments_made=arguments_made,
+            # Sorted argument tuple per case, the key for combination counts
+            argument_combos=[tuple(sorted(made)) for made in arguments_made],
+            rfe_issues=[c.get("rfe_issues") or [] for c in cases],
+            cases=cases,
+        )
+
+    def __len__(self):
+        return len(self.cases)
+
+    def rows(self, idx=None):
+        """Yield the case dicts, optionally only those at idx (display code)."""
+        if idx is None:
+            yield from self.cases
+        else:
+            for i in idx:
+                yield self.cases[i]
@@ -1,19 +1,132 @@
 """Build NetworkX knowledge graph from MongoDB H-1B AAO cases."""
 
-import os
+import sys
 import pickle
-import warnings
+from collections import Counter
+from pathlib import Path
 import numpy as np
 import networkx as nx
-from pathlib import Path
-from dotenv import load_dotenv
+import orjson
+import zstandard
 from pymongo import MongoClient
-from sklearn.metrics.pairwise import cosine_similarity
 
-warnings.filterwarnings("ignore", category=RuntimeWarning, module="sklearn")
+from _env import load_env
+from db import CLIENT_OPTIONS, get_client
+
+from .similarity_search import ANN_MIN_CASES as SEARCH_ANN_MIN_CASES, hnsw_index
+
+try:
+    import faiss
+    HAS_FAISS = True
+except ImportError:
+    HAS_FAISS = False
+
+load_env()
+
+# Case metadata pulled from MongoDB; full_text and other fields stay server-side
+CASE_FIELDS = (
+    "case_number", "outcome", "decision_date", "service_center", "job_title",
+    "company_name", "company_type", "wage_level", "rfe_issues", "denial_reasons",
+    "arguments_made", "x_2d", "y_2d", "filename",
+)
+
+# List-of-label case fields whose strings are interned on load
+INTERNED_FIELDS = ("rfe_issues", "denial_reasons", "arguments_made")
+
+# Above this many cases SIMILAR_TO pairs come from an HNSW index (if faiss
+# is installed); below it the exact blocked matmul is fast enough
+ANN_MIN_CASES = 20000
+ANN_NEIGHBOURS = 64
+# Memory budget for one block of the exact similarity scan
+SIMILARITY_BLOCK_BYTES = 256 * 1024 * 1024
+
+
+def _interned(values):
+    """Copy a label list with each string interned (stored once per process)."""
+    return [sys.intern(v) if isinstance(v, str) else v for v in values or []]
+
+
+def _outcome(value):
+    """Upper-case and intern an outcome label once at load time."""
+    return sys.intern(value.upper()) if isinstance(value, str) else value
+
+
+def quantize_embeddings(embeddings):
+    """Quantise float vectors to int8 with one scale per row.
+
+    Returns:
+        tuple: (int8 matrix, float32 per-row scales)
+    """
+    scales = np.abs(embeddings).max(axis=1).astype(np.float32) / 127
+    scales[scales == 0] = 1.0
+    quantized = np.rint(embeddings / scales[:, None]).astype(np.int8)
+    return quantized, scales
+
+
+def similar_pairs(embeddings, threshold, quantize=False, block_size=None):
+    """Find all pairs i < j of unit vectors with dot product above threshold.
+
+    Rows are scored in blocks against the columns at or after the block
+    (the upper triangle only), so peak memory stays at block_size x N
+    instead of a full N x N matrix. By default block_size is sized to
+    SIMILARITY_BLOCK_BYTES.
+
+    Returns:
+        tuple: (row indices, column indices, similarities) as numpy arrays
+    """
+    if HAS_FAISS and not quantize and len(embeddings) >= ANN_MIN_CASES:
+        return _ann_similar_pairs(embeddings, threshold)
+
+    if quantize:
+        quantized, scales = quantize_embeddings(embeddings)
+        # numpy has no int8 GEMM; upcast for BLAS and rescale afterwards
+        vectors = quantized.astype(np.float32)
+    else:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+
+    if block_size is None:
+        block_size = max(1, min(2048, SIMILARITY_BLOCK_BYTES // (4 * len(vectors))))
+
+    rows, cols, sims = [], [], []
+    for start in range(0, len(vectors), block_size):
+        stop = start + block_size
+        # Only columns >= start can hold pairs with j > i for these rows
+        block = vectors[start:stop] @ vectors[start:].T
+        if quantize:
+            block *= scales[start:stop, None] * scales[None, start:]
+        i, j = np.nonzero(block > threshold)
+        upper = j > i
+        i, j = i[upper], j[upper]
+        rows.append(i + start)
+        cols.append(j + start)
+        sims.append(block[i, j])
+
+    if not rows:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0, dtype=np.float32)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(sims)
+
+
+def _ann_similar_pairs(embeddings, threshold):
+    """Approximate similar_pairs() with a FAISS HNSW inner-product index.
 
-env_path = Path(__file__).parent.parent.parent / ".env"
-load_dotenv(env_path)
+    Each case keeps at most ANN_NEIGHBOURS neighbours above threshold.
+    """
+    vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+    index = faiss.IndexHNSWFlat(vectors.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = 200
+    index.add(vectors)
+    index.hnsw.efSearch = 2 * ANN_NEIGHBOURS
+
+    sims, neighbours = index.search(vectors, ANN_NEIGHBOURS + 1)  # +1 for self
+    rows = np.repeat(np.arange(len(vectors)), neighbours.shape[1])
+    cols, sims = neighbours.ravel(), sims.ravel()
+    # -1 marks unfilled slots; the search is not symmetric, so order each
+    # pair as (low, high) and drop the mirrored duplicates
+    keep = (cols >= 0) & (cols != rows) & (sims > threshold)
+    rows, cols, sims = rows[keep], cols[keep], sims[keep]
+    pairs = np.stack([np.minimum(rows, cols), np.maximum(rows, cols)], axis=1)
+    pairs, first = np.unique(pairs, axis=0, return_index=True)
+    return pairs[:, 0], pairs[:, 1], sims[first]
 
 
 class GraphBuilder:
@@ -23,149 +136,183 @@ class GraphBuilder:
         self.G = nx.DiGraph()
         self.cases = []
         self.embeddings = None
+        # True once every embedding row is known to be unit-length float32
+        self.normalized = False
+        # Query-time HNSW index over the embeddings, when one was persisted
+        self.ann_index = None
+
+    def load_from_mongodb(self, uri=None, db_name="rfe_tool", collection_name="cases",
+                          extra_fields=()):
+        """Load all complete cases with embeddings from MongoDB.
 
-    def load_from_mongodb(self, uri=None, db_name="rfe_tool", collection_name="cases"):
-        """Load all complete cases with embeddings from MongoDB."""
-        uri = uri or os.environ.get("MONGODB_URI")
-        if not uri:
+        extra_fields names additional case fields to project and keep on
+        each case; everything else stays server-side.
+        """
+        # The shared client carries the wire compressors and pool settings;
+        # an explicit uri gets its own client with the same options
+        client = MongoClient(uri, **CLIENT_OPTIONS) if uri else get_client()
+        if client is None:
             raise ValueError(
                 "No MongoDB URI. Pass uri= or set MONGODB_URI in .env"
             )
 
-        client = MongoClient(uri)
         db = client[db_name]
         collection = db[collection_name]
 
         query = {"status": "complete", "embedding": {"$exists": True}}
-        raw_cases = list(collection.find(query))
-        client.close()
-
-        if not raw_cases:
-            raise ValueError(
-                f"No complete cases with embeddings in {db_name}.{collection_name}"
-            )
-
-        # Separate embeddings from case metadata — normalise to unit vectors
-        # to prevent overflow in cosine similarity calculations
-        raw_emb = np.array([c["embedding"] for c in raw_cases], dtype=np.float64)
-        norms = np.linalg.norm(raw_emb, axis=1, keepdims=True)
-        norms[norms == 0] = 1.0  # avoid division by zero
-        self.embeddings = raw_emb / norms
+        projection = {field: 1 for field in (*CASE_FIELDS, *extra_fields)}
+        projection["embedding_bin"] = 1
+        # Only ship the BSON array for cases without the packed vector
+        projection["embedding"] = {"$cond": [
+            {"$eq": [{"$type": "$embedding_bin"}, "missing"]}, "$embedding", "$$REMOVE",
+        ]}
+        n_cases = collection.count_documents(query)
+        # The server still caps each batch at 16MB of documents
+        cursor = collection.find(query, projection).batch_size(5000)
 
-        # Store cases without embedding/full_text to keep memory light
+        # Fill a preallocated float32 matrix row by row so the embeddings
+        # never exist twice (as Python lists and as an array) at once
+        raw_emb = None
+        needs_norm = np.zeros(n_cases, dtype=bool)
         self.cases = []
-        for i, c in enumerate(raw_cases):
+        for i, c in enumerate(cursor):
+            if i >= n_cases:
+                break  # cases completed after the count land on the next build
+            if "embedding_bin" in c:
+                # Stored already unit-normalised as packed float32
+                vector = np.frombuffer(c["embedding_bin"], dtype=np.float32)
+            else:
+                vector = c["embedding"]
+                needs_norm[i] = True
+            if raw_emb is None:
+                raw_emb = np.empty((n_cases, len(vector)), dtype=np.float32)
+            raw_emb[i] = vector
+
+            # Keep only metadata alongside the matrix to keep memory light
             self.cases.append({
                 "index": i,
                 "mongo_id": str(c["_id"]),
                 "case_number": c.get("case_number", ""),
-                "outcome": c.get("outcome", "UNKNOWN"),
+                "outcome": _outcome(c.get("outcome", "UNKNOWN")),
                 "decision_date": c.get("decision_date", ""),
                 "service_center": c.get("service_center", ""),
                 "job_title": c.get("job_title", ""),
                 "company_name": c.get("company_name", ""),
                 "company_type": c.get("company_type", "unknown"),
                 "wage_level": c.get("wage_level", ""),
-                "rfe_issues": c.get("rfe_issues") or [],
-                "denial_reasons": c.get("denial_reasons") or [],
-                "arguments_made": c.get("arguments_made") or [],
+                "rfe_issues": _interned(c.get("rfe_issues")),
+                "denial_reasons": _interned(c.get("denial_reasons")),
+                "arguments_made": _interned(c.get("arguments_made")),
                 "x_2d": c.get("x_2d", 0.0),
                 "y_2d": c.get("y_2d", 0.0),
                 "filename": c.get("filename", ""),
+                **{field: c.get(field) for field in extra_fields},
             })
+        if uri:
+            client.close()  # the shared client stays open for other callers
+
+        if not self.cases:
+            raise ValueError(
+                f"No complete cases with embeddings in {db_name}.{collection_name}"
+            )
+
+        # Normalise legacy array embeddings to unit vectors to prevent
+        # overflow in cosine similarity calculations
+        raw_emb = raw_emb[:len(self.cases)]
+        needs_norm = needs_norm[:len(self.cases)]
+        if needs_norm.any():
+            norms = np.linalg.norm(raw_emb[needs_norm], axis=1, keepdims=True)
+            norms[norms == 0] = 1.0  # avoid division by zero
+            raw_emb[needs_norm] /= norms
+        self.embeddings = raw_emb
+        self.normalized = True
 
         # Print distribution
-        outcomes = {}
-        for c in self.cases:
-            o = c["outcome"]
-            outcomes[o] = outcomes.get(o, 0) + 1
+        outcomes = Counter(c["outcome"] for c in self.cases)
         print(f"Loaded {len(self.cases)} cases from MongoDB")
-        print(f"Outcome distribution: {outcomes}")
+        print(f"Outcome distribution: {dict(outcomes)}")
 
         return self.cases
 
-    def build_graph(self, similarity_threshold=0.92):
-        """Build knowledge graph with all node and edge types."""
+    def build_graph(self, similarity_threshold=0.92, quantize=False):
+        """Build knowledge graph with all node and edge types.
+
+        quantize=True scores SIMILAR_TO pairs from int8-quantised embeddings,
+        which keeps the stored matrix 4x smaller on very large corpora.
+        """
         G = nx.DiGraph()
 
-        # --- Add nodes and relationship edges for each case ---
+        # --- Collect nodes and relationship edges for each case ---
+        case_nodes, entity_nodes, type_edges = [], [], []
+        seen = set()
+
+        def link(case_id, node_id, node_type, value, edge_type):
+            if node_id not in seen:
+                seen.add(node_id)
+                entity_nodes.append((node_id, {"node_type": node_type, "value": value}))
+            type_edges.append((case_id, node_id, {"edge_type": edge_type}))
+
+        # Node id per case index, built once and shared by the SIMILAR_TO pairs
+        case_ids = [f"case_{c['index']}" for c in self.cases]
+
         for case in self.cases:
-            idx = case["index"]
-            case_id = f"case_{idx}"
+            case_id = case_ids[case["index"]]
 
             # Case node
-            G.add_node(case_id, node_type="Case", **{
-                k: v for k, v in case.items()
-                if k not in ("index", "mongo_id")
-            })
+            attrs = {k: v for k, v in case.items() if k not in ("index", "mongo_id")}
+            attrs["node_type"] = "Case"
+            case_nodes.append((case_id, attrs))
 
             # Outcome -> RESULTED_IN
             outcome = case["outcome"]
             if outcome:
-                oid = f"outcome_{outcome}"
-                if oid not in G:
-                    G.add_node(oid, node_type="Outcome", value=outcome)
-                G.add_edge(case_id, oid, edge_type="RESULTED_IN")
+                link(case_id, f"outcome_{outcome}", "Outcome", outcome, "RESULTED_IN")
 
             # Arguments -> USED_ARGUMENT
             for arg in case["arguments_made"]:
-                aid = f"arg_{arg}"
-                if aid not in G:
-                    G.add_node(aid, node_type="Argument", value=arg)
-                G.add_edge(case_id, aid, edge_type="USED_ARGUMENT")
+                link(case_id, f"arg_{arg}", "Argument", arg, "USED_ARGUMENT")
 
             # Company type -> FILED_BY
             ct = case["company_type"]
             if ct:
-                ctid = f"comptype_{ct}"
-                if ctid not in G:
-                    G.add_node(ctid, node_type="Company_Type", value=ct)
-                G.add_edge(case_id, ctid, edge_type="FILED_BY")
+                link(case_id, f"comptype_{ct}", "Company_Type", ct, "FILED_BY")
 
             # Job title -> FOR_ROLE
             jt = case["job_title"]
             if jt:
-                jtid = f"role_{jt}"
-                if jtid not in G:
-                    G.add_node(jtid, node_type="Job_Title", value=jt)
-                G.add_edge(case_id, jtid, edge_type="FOR_ROLE")
+                link(case_id, f"role_{jt}", "Job_Title", jt, "FOR_ROLE")
 
             # RFE issues -> RECEIVED_RFE
             for issue in case["rfe_issues"]:
-                rid = f"rfe_{issue}"
-                if rid not in G:
-                    G.add_node(rid, node_type="RFE_Issue", value=issue)
-                G.add_edge(case_id, rid, edge_type="RECEIVED_RFE")
+                link(case_id, f"rfe_{issue}", "RFE_Issue", issue, "RECEIVED_RFE")
+
+        G.add_nodes_from(case_nodes)
+        G.add_nodes_from(entity_nodes)
+        G.add_edges_from(type_edges)
 
         # --- SIMILAR_TO edges from embedding cosine similarity ---
         n_similar = 0
         if self.embeddings is not None and len(self.embeddings) > 1:
-            sim_matrix = cosine_similarity(self.embeddings)
-
-            for i in range(len(self.cases)):
-                for j in range(i + 1, len(self.cases)):
-                    sim = float(sim_matrix[i][j])
-                    if sim > similarity_threshold:
-                        G.add_edge(
-                            f"case_{i}", f"case_{j}",
-                            edge_type="SIMILAR_TO", weight=sim,
-                        )
-                        G.add_edge(
-                            f"case_{j}", f"case_{i}",
-                            edge_type="SIMILAR_TO", weight=sim,
-                        )
-                        n_similar += 1
+            rows, cols, sims = similar_pairs(
+                self.embeddings, similarity_threshold, quantize=quantize
+            )
+            pairs = [
+                (case_ids[i], case_ids[j], sim)
+                for i, j, sim in zip(rows.tolist(), cols.tolist(), sims.tolist())
+            ]
+            # Similarity is symmetric: one edge per pair, lower index -> higher
+            G.add_weighted_edges_from(pairs, edge_type="SIMILAR_TO")
+            n_similar = len(pairs)
 
         self.G = G
 
         # Stats
-        def count_type(t):
-            return sum(1 for _, d in G.nodes(data=True) if d.get("node_type") == t)
+        counts = Counter(d.get("node_type") for _, d in G.nodes(data=True))
 
         print(f"\nGraph built:")
         print(f"  Nodes: {G.number_of_nodes()}  |  Edges: {G.number_of_edges()}")
-        print(f"  Cases: {count_type('Case')}  |  Arguments: {count_type('Argument')}")
-        print(f"  Job Titles: {count_type('Job_Title')}  |  RFE Issues: {count_type('RFE_Issue')}")
+        print(f"  Cases: {counts['Case']}  |  Arguments: {counts['Argument']}")
+        print(f"  Job Titles: {counts['Job_Title']}  |  RFE Issues: {counts['RFE_Issue']}")
         print(f"  SIMILAR_TO pairs: {n_similar} (threshold={similarity_threshold})")
 
         if n_similar == 0:
@@ -176,23 +323,74 @@ class GraphBuilder:
 
         return G
 
-    def save_graph(self, path="h1b_graph.pkl"):
-        """Persist graph + cases + embeddings to disk."""
-        with open(path, "wb") as f:
-            pickle.dump({
-                "graph": self.G,
-                "cases": self.cases,
-                "embeddings": self.embeddings,
-            }, f)
+    def save_graph(self, path="h1b_graph"):
+        """Persist graph + cases + embeddings to a cache directory.
+
+        Embeddings go to a float32 .npy of unit rows so load_graph can
+        memory-map them; the graph and case metadata are stored as
+        zstd-compressed JSON. On corpora large enough for SimilaritySearch
+        to use an HNSW index (and with faiss installed) the index is built
+        here and written to ann.faiss, so engine loads don't rebuild it.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        emb = np.asarray(self.embeddings, dtype=np.float32)
+        if not self.normalized:
+            norms = np.linalg.norm(emb, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            emb = emb / norms
+        np.save(path / "embeddings.npy", emb)
+        ann_path = path / "ann.faiss"
+        ann_path.unlink(missing_ok=True)  # never leave a stale index behind
+        self.ann_index = None
+        if HAS_FAISS and len(emb) >= SEARCH_ANN_MIN_CASES:
+            self.ann_index = hnsw_index(emb)
+            faiss.write_index(self.ann_index, str(ann_path))
+        compressor = zstandard.ZstdCompressor(level=3)
+        (path / "cases.json.zst").write_bytes(compressor.compress(orjson.dumps(self.cases)))
+        (path / "graph.json.zst").write_bytes(
+            compressor.compress(orjson.dumps(nx.node_link_data(self.G)))
+        )
         print(f"Graph saved to {path}")
 
-    def load_graph(self, path="h1b_graph.pkl"):
-        """Load persisted graph from disk."""
-        with open(path, "rb") as f:
-            data = pickle.load(f)
-        self.G = data["graph"]
-        self.cases = data["cases"]
-        self.embeddings = data["embeddings"]
+    def load_graph(self, path="h1b_graph", mmap=True):
+        """Load a persisted graph from disk.
+
+        With mmap=True the embeddings are memory-mapped rather than read in
+        full. Falls back to the legacy single-file pickle at <path>.pkl when
+        the cache directory has not been built yet.
+        """
+        path = Path(path)
+        legacy = path if path.suffix == ".pkl" else path.with_suffix(".pkl")
+        if not path.is_dir() and legacy.is_file():
+            with open(legacy, "rb") as f:
+                data = pickle.load(f)
+            self.G = data["graph"]
+            self.cases = data["cases"]
+            self.embeddings = data["embeddings"]
+            self.normalized = False  # legacy pickles make no promise
+            self.ann_index = None
+        else:
+            decompressor = zstandard.ZstdDecompressor()
+
+            def read_json(name):
+                with open(path / name, "rb") as f, decompressor.stream_reader(f) as reader:
+                    return orjson.loads(reader.read())
+
+            self.G = nx.node_link_graph(read_json("graph.json.zst"))
+            self.cases = read_json("cases.json.zst")
+            for c in self.cases:
+                c["outcome"] = _outcome(c.get("outcome"))
+                for field in INTERNED_FIELDS:
+                    c[field] = _interned(c.get(field))
+            # Pages in only the rows a search touches
+            self.embeddings = np.load(path / "embeddings.npy", mmap_mode="r" if mmap else None)
+            self.normalized = True  # save_graph only writes unit rows
+            ann_path = path / "ann.faiss"
+            self.ann_index = None
+            if HAS_FAISS and ann_path.is_file():
+                flags = faiss.IO_FLAG_MMAP if mmap else 0
+                self.ann_index = faiss.read_index(str(ann_path), flags)
         print(
             f"Graph loaded: {self.G.number_of_nodes()} nodes, "
             f"{self.G.number_of_edges()} edges, {len(self.cases)} cases"
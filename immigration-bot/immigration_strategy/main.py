@@ -6,16 +6,18 @@ import json
 import argparse
 from pathlib import Path
 
+import orjson
+
 # Allow running as script from inside the package
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from immigration_strategy.strategy_engine import RecommendationEngine
-
-CACHE_PATH = str(Path(__file__).parent / "h1b_graph.pkl")
+CACHE_PATH = str(Path(__file__).parent / "h1b_graph")
 
 
 def cmd_build(args):
     """Build the knowledge graph from MongoDB and cache it."""
+    from immigration_strategy.strategy_engine import RecommendationEngine
+
     engine = RecommendationEngine()
     engine.load_from_mongodb(
         uri=args.uri,
@@ -23,17 +25,20 @@ def cmd_build(args):
         collection_name=args.collection,
         similarity_threshold=args.threshold,
         cache_path=CACHE_PATH,
+        extra_fields=args.projection.split(",") if args.projection else (),
     )
     print(f"\nGraph cached to {CACHE_PATH}")
 
 
 def cmd_recommend(args):
     """Run a recommendation for a user profile."""
+    from immigration_strategy.strategy_engine import RecommendationEngine
+
     engine = RecommendationEngine()
 
-    if os.path.exists(CACHE_PATH):
+    if os.path.exists(CACHE_PATH) or os.path.exists(CACHE_PATH + ".pkl"):
         print(f"Loading cached graph from {CACHE_PATH} ...")
-        engine.load_from_cache(CACHE_PATH)
+        engine.load_from_cache(CACHE_PATH, mmap=not args.no_mmap)
     else:
         print("No cache found — building from MongoDB ...")
         engine.load_from_mongodb(cache_path=CACHE_PATH)
@@ -60,7 +65,9 @@ def cmd_recommend(args):
         print(json.dumps(profile, indent=2))
 
     print("\nGenerating recommendations ...\n")
-    result = engine.recommend_strategy(profile, viz_path=args.output)
+    result = engine.recommend_strategy(
+        profile, viz_path=False if args.no_viz else args.output,
+    )
 
     # Pretty-print results
     print("=" * 70)
@@ -109,12 +116,13 @@ def cmd_recommend(args):
         sim = c.get("similarity_score") or 0
         print(f"  [{out}] {cnum} — {jtitle} (sim={sim:.2f})")
 
-    print(f"\nVisualization: {result['graph_viz_path']}")
+    if result["graph_viz_path"]:
+        print(f"\nVisualization: {result['graph_viz_path']}")
 
     # Also dump full JSON
     json_path = str(Path(__file__).parent.parent / "strategy_result.json")
-    with open(json_path, "w") as f:
-        json.dump(result, f, indent=2, default=str)
+    with open(json_path, "wb") as f:
+        f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
     print(f"Full JSON: {json_path}")
 
 
@@ -131,6 +139,8 @@ def main():
     build_p.add_argument("--collection", default="cases", help="Collection name")
     build_p.add_argument("--threshold", type=float, default=0.92,
                          help="Cosine similarity threshold for SIMILAR_TO edges")
+    build_p.add_argument("--projection", default=None,
+                         help="Comma-separated extra case fields to load from MongoDB")
 
     # --- recommend ---
     rec_p = sub.add_parser("recommend", help="Get strategy recommendation")
@@ -145,6 +155,10 @@ def main():
                        help="Comma-separated current arguments")
     rec_p.add_argument("--output", default=None,
                        help="Path for HTML visualization")
+    rec_p.add_argument("--no-viz", action="store_true",
+                       help="Skip writing the HTML visualization")
+    rec_p.add_argument("--no-mmap", action="store_true",
+                       help="Read cached embeddings fully into memory instead of memory-mapping")
 
     args = parser.parse_args()
 
@@ -1,25 +1,55 @@
 """Pattern mining, association rules, and counterfactual analysis."""
 
 import warnings
-from collections import defaultdict
+from functools import lru_cache
+from collections import Counter
 
 import numpy as np
-import pandas as pd
+from scipy.sparse import csr_matrix
 
-try:
-    from mlxtend.frequent_patterns import apriori, association_rules
-    from mlxtend.preprocessing import TransactionEncoder
-    HAS_MLXTEND = True
-except ImportError:
-    HAS_MLXTEND = False
+from .case_table import CaseTable
+
+
+@lru_cache(maxsize=1)
+def _mlxtend():
+    """Import mlxtend (and with it pandas) on first use, not at CLI startup.
+
+    Returns:
+        tuple | None: (apriori, association_rules), or None if not installed
+    """
+    try:
+        from mlxtend.frequent_patterns import apriori, association_rules
+    except ImportError:
+        return None
+    return apriori, association_rules
 
 
 class PatternAnalyzer:
     """Mines patterns from H-1B case data and the knowledge graph."""
 
-    def __init__(self, cases, graph=None):
+    def __init__(self, cases, graph=None, table=None):
         self.cases = cases
         self.G = graph
+        self.table = table if table is not None else CaseTable.from_cases(cases)
+        self._args, self._arg_matrix, self._sustained = self._encode_arguments(self.table)
+        self._arg_index = {a: j for j, a in enumerate(self._args)}
+        self._items = None
+        self._transactions = None
+
+    @staticmethod
+    def _encode_arguments(table):
+        """Encode a CaseTable as a (case x argument) bool matrix plus an outcome vector.
+
+        Argument columns are in sorted order.
+        """
+        args = sorted({a for made in table.arguments_made for a in made})
+        col = {a: j for j, a in enumerate(args)}
+        matrix = np.zeros((len(table), len(args)), dtype=bool)
+        for i, made in enumerate(table.arguments_made):
+            for a in made:
+                matrix[i, col[a]] = True
+        sustained = table.outcomes == "SUSTAINED"
+        return args, matrix, sustained
 
     # ------------------------------------------------------------------
     # 1. Argument effectiveness for a set of similar cases
@@ -30,28 +60,32 @@ class PatternAnalyzer:
 
         Returns dict keyed by argument name with success stats.
         """
-        arg_stats = defaultdict(lambda: {"sustained": 0, "dismissed": 0, "remanded": 0, "total": 0})
-
-        for c in similar_cases:
-            outcome = (c.get("outcome") or "").upper()
-            for arg in c.get("arguments_made", []):
-                arg_stats[arg]["total"] += 1
-                if outcome == "SUSTAINED":
-                    arg_stats[arg]["sustained"] += 1
-                elif outcome == "DISMISSED":
-                    arg_stats[arg]["dismissed"] += 1
-                elif outcome == "REMANDED":
-                    arg_stats[arg]["remanded"] += 1
+        rows = self._rows_for(similar_cases)
+        if rows is not None:
+            outcomes = self.table.outcomes[list(rows)].tolist()
+            arg_lists = [self.table.arguments_made[i] for i in rows]
+        else:
+            outcomes = [(c.get("outcome") or "").upper() for c in similar_cases]
+            arg_lists = [c.get("arguments_made", []) for c in similar_cases]
+
+        # One flat pass of (argument, outcome) pairs, tallied by Counter
+        pairs = [
+            (arg, outcome)
+            for outcome, made in zip(outcomes, arg_lists)
+            for arg in made
+        ]
+        totals = Counter(arg for arg, _ in pairs)
+        by_outcome = Counter(pairs)
 
         results = {}
-        for arg, stats in arg_stats.items():
-            total = stats["total"]
-            success_rate = stats["sustained"] / total if total else 0
+        for arg, total in totals.items():
+            sustained = by_outcome[(arg, "SUSTAINED")]
+            success_rate = sustained / total if total else 0
             results[arg] = {
                 "success_rate": round(success_rate, 3),
-                "sustained": stats["sustained"],
-                "dismissed": stats["dismissed"],
-                "remanded": stats["remanded"],
+                "sustained": sustained,
+                "dismissed": by_outcome[(arg, "DISMISSED")],
+                "remanded": by_outcome[(arg, "REMANDED")],
                 "total": total,
                 "confidence": self._confidence_label(total),
             }
@@ -68,32 +102,16 @@ class PatternAnalyzer:
 
         Returns list of rule dicts, filtered for SUSTAINED consequent.
         """
-        if not HAS_MLXTEND:
+        mlxtend = _mlxtend()
+        if mlxtend is None:
             return self._fallback_rules(min_confidence)
+        apriori, association_rules = mlxtend
 
-        transactions = []
-        for c in self.cases:
-            items = set()
-            ct = c.get("company_type")
-            if ct:
-                items.add(f"comptype:{ct}")
-            wl = c.get("wage_level")
-            if wl:
-                items.add(f"wage:{wl}")
-            for rfe in c.get("rfe_issues", []):
-                items.add(f"rfe:{rfe}")
-            for arg in c.get("arguments_made", []):
-                items.add(f"arg:{arg}")
-            items.add(f"outcome:{c.get('outcome', 'UNKNOWN')}")
-            transactions.append(list(items))
-
-        te = TransactionEncoder()
-        te_ary = te.fit(transactions).transform(transactions)
-        df = pd.DataFrame(te_ary, columns=te.columns_)
+        df = self._transaction_frame()
 
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
-            freq = apriori(df, min_support=min_support, use_colnames=True)
+            freq = apriori(df, min_support=min_support, use_colnames=True, low_memory=True)
 
         if freq.empty:
             return []
@@ -124,44 +142,90 @@ class PatternAnalyzer:
         results.sort(key=lambda r: -r["confidence"])
         return results
 
+    def _item_matrix(self):
+        """One-hot case items as a sparse (case x item) bool matrix, built once.
+
+        Returns:
+            tuple: (item names in sorted order, CSR matrix with one column each)
+        """
+        if self._items is None:
+            rows, cols, vocab = [], [], {}
+            for i, c in enumerate(self.cases):
+                items = set()
+                ct = c.get("company_type")
+                if ct:
+                    items.add(f"comptype:{ct}")
+                wl = c.get("wage_level")
+                if wl:
+                    items.add(f"wage:{wl}")
+                for rfe in c.get("rfe_issues", []):
+                    items.add(f"rfe:{rfe}")
+                for arg in c.get("arguments_made", []):
+                    items.add(f"arg:{arg}")
+                items.add(f"outcome:{c.get('outcome', 'UNKNOWN')}")
+                for item in items:
+                    rows.append(i)
+                    cols.append(vocab.setdefault(item, len(vocab)))
+
+            # Reorder columns alphabetically, as TransactionEncoder does
+            names = sorted(vocab)
+            order = np.empty(len(names), dtype=np.intp)
+            order[[vocab[n] for n in names]] = np.arange(len(names))
+            matrix = csr_matrix(
+                (np.ones(len(rows), dtype=bool), (rows, order[cols])),
+                shape=(len(self.cases), len(names)),
+            )
+            self._items = (names, matrix)
+        return self._items
+
+    def _transaction_frame(self):
+        """The item matrix as a sparse bool DataFrame for mlxtend, built once.
+
+        Same columns (sorted item names) as mlxtend's TransactionEncoder,
+        without its dense N x V array.
+        """
+        if self._transactions is None:
+            import pandas as pd
+
+            names, matrix = self._item_matrix()
+            self._transactions = pd.DataFrame.sparse.from_spmatrix(matrix, columns=names)
+        return self._transactions
+
     def _fallback_rules(self, min_confidence):
-        """Simple co-occurrence rules when mlxtend is not installed."""
-        combo_stats = defaultdict(lambda: {"sustained": 0, "total": 0})
-        for c in self.cases:
-            outcome = c.get("outcome", "")
-            features = []
-            ct = c.get("company_type")
-            if ct:
-                features.append(f"comptype:{ct}")
-            for arg in c.get("arguments_made", []):
-                features.append(f"arg:{arg}")
-            for rfe in c.get("rfe_issues", []):
-                features.append(f"rfe:{rfe}")
-
-            # Singles and pairs
-            for f in features:
-                combo_stats[(f,)]["total"] += 1
-                if outcome == "SUSTAINED":
-                    combo_stats[(f,)]["sustained"] += 1
-            for i in range(len(features)):
-                for j in range(i + 1, len(features)):
-                    key = tuple(sorted([features[i], features[j]]))
-                    combo_stats[key]["total"] += 1
-                    if outcome == "SUSTAINED":
-                        combo_stats[key]["sustained"] += 1
+        """Simple co-occurrence rules when mlxtend is not installed.
+
+        Single and pair supports come from the item matrix as X.T @ X over
+        all cases and over SUSTAINED cases.
+        """
+        names, matrix = self._item_matrix()
+        features = [j for j, name in enumerate(names)
+                    if name.startswith(("comptype:", "arg:", "rfe:"))]
+        x = matrix[:, features].astype(np.int32)
+        if "outcome:SUSTAINED" in names:
+            col = matrix[:, names.index("outcome:SUSTAINED")]
+            sustained_rows = col.toarray().ravel()
+        else:
+            sustained_rows = np.zeros(len(self.cases), dtype=bool)
+        xs = x[sustained_rows]
+
+        # Diagonal: single-item counts; upper triangle: pair counts
+        totals = (x.T @ x).toarray()
+        sustained = (xs.T @ xs).toarray()
 
         results = []
-        for combo, stats in combo_stats.items():
-            if stats["total"] < 2:
+        for i, j in zip(*np.triu_indices(len(features))):
+            total = int(totals[i, j])
+            if total < 2:
                 continue
-            conf = stats["sustained"] / stats["total"]
+            conf = sustained[i, j] / total
             if conf >= min_confidence:
+                combo = [names[features[i]]] if i == j else [names[features[i]], names[features[j]]]
                 results.append({
-                    "antecedent": list(combo),
-                    "confidence": round(conf, 3),
-                    "support": round(stats["total"] / len(self.cases), 3),
+                    "antecedent": combo,
+                    "confidence": round(float(conf), 3),
+                    "support": round(total / len(self.cases), 3),
                     "lift": 0.0,
-                    "sample_size": stats["total"],
+                    "sample_size": total,
                 })
         results.sort(key=lambda r: -r["confidence"])
         return results
@@ -177,32 +241,75 @@ class PatternAnalyzer:
         """
         cases = cases_subset or self.cases
 
-        all_args = set()
-        for c in cases:
-            all_args.update(c.get("arguments_made", []))
-
-        results = {}
-        for arg in sorted(all_args):
-            with_arg = [c for c in cases if arg in (c.get("arguments_made") or [])]
-            without_arg = [c for c in cases if arg not in (c.get("arguments_made") or [])]
+        rows = self._rows_for(cases)
+        if cases is self.cases:
+            args, matrix, sustained = self._args, self._arg_matrix, self._sustained
+        elif rows is not None:
+            rows = list(rows)
+            used = self._arg_matrix[rows].any(axis=0)
+            args = [a for a, u in zip(self._args, used) if u]
+            matrix = self._arg_matrix[np.ix_(rows, used)]
+            sustained = self._sustained[rows]
+        else:
+            args, matrix, sustained = self._encode_arguments(CaseTable.from_cases(cases))
 
-            with_sust = sum(1 for c in with_arg if c.get("outcome") == "SUSTAINED")
-            wo_sust = sum(1 for c in without_arg if c.get("outcome") == "SUSTAINED")
+        n = len(cases)
+        with_counts = matrix.sum(axis=0)
+        with_sust = matrix.T.astype(np.int32) @ sustained.astype(np.int32)
+        without_counts = n - with_counts
+        wo_sust = int(sustained.sum()) - with_sust
 
-            with_rate = with_sust / len(with_arg) if with_arg else 0
-            wo_rate = wo_sust / len(without_arg) if without_arg else 0
+        results = {}
+        for j, arg in enumerate(args):
+            with_n, wo_n = int(with_counts[j]), int(without_counts[j])
+            with_rate = with_sust[j] / with_n if with_n else 0
+            wo_rate = wo_sust[j] / wo_n if wo_n else 0
 
             results[arg] = {
-                "with_count": len(with_arg),
-                "without_count": len(without_arg),
-                "with_success_rate": round(with_rate, 3),
-                "without_success_rate": round(wo_rate, 3),
-                "impact": round(with_rate - wo_rate, 3),
-                "confidence": self._confidence_label(len(with_arg)),
+                "with_count": with_n,
+                "without_count": wo_n,
+                "with_success_rate": round(float(with_rate), 3),
+                "without_success_rate": round(float(wo_rate), 3),
+                "impact": round(float(with_rate - wo_rate), 3),
+                "confidence": self._confidence_label(with_n),
             }
 
         return dict(sorted(results.items(), key=lambda x: -x[1]["impact"]))
 
+    def _rows_for(self, cases):
+        """Rows of cases in self.cases, from the "index" similar cases carry.
+
+        Returns None when any case can't be mapped back.
+        """
+        rows = tuple(c.get("index") for c in cases)
+        if all(isinstance(i, int) and 0 <= i < len(self.cases) for i in rows):
+            return rows
+        return None
+
+    def _impacts(self, args, rows):
+        """counterfactual_analysis() impacts of args over the given rows.
+
+        Returns an array aligned with args; NaN where no case in rows used
+        the argument (counterfactual_analysis would omit it).
+        """
+        cols = [self._arg_index.get(a, -1) for a in args]
+        known = np.array([c >= 0 for c in cols], dtype=bool)
+        impacts = np.full(len(args), np.nan)
+        if not known.any():
+            return impacts
+
+        idx = np.array(rows, dtype=np.intp)
+        has_arg = self._arg_matrix[np.ix_(idx, [c for c in cols if c >= 0])]
+        sustained = self._sustained[idx].astype(np.int32)
+        with_n = has_arg.sum(axis=0)
+        wo_n = len(idx) - with_n
+        with_sust = sustained @ has_arg
+        wo_sust = sustained.sum() - with_sust
+        with_rate = np.divide(with_sust, with_n, out=np.zeros(len(with_n)), where=with_n > 0)
+        wo_rate = np.divide(wo_sust, wo_n, out=np.zeros(len(wo_n)), where=wo_n > 0)
+        impacts[known] = np.where(with_n > 0, np.round(with_rate - wo_rate, 3), np.nan)
+        return impacts
+
     # ------------------------------------------------------------------
     # 4. Success probability for a user profile
     # ------------------------------------------------------------------
@@ -224,17 +331,22 @@ class PatternAnalyzer:
         else:
             base_prob = float(np.average(outcomes, weights=weights))
 
-        # Argument boost: if user has args that correlate with success
-        counterfactuals = self.counterfactual_analysis(similar_cases)
-        user_args = set(user_profile.get("current_arguments", []))
-        boost = 0.0
-        for arg in user_args:
-            if arg in counterfactuals:
-                impact = counterfactuals[arg]["impact"]
-                if impact > 0:
-                    boost += impact * 0.3  # dampen the boost
-
-        adjusted = min(1.0, max(0.0, base_prob + boost))
+        # Argument boost: if user has args that correlate with success.
+        # Only the user's own arguments are scored, not every argument seen.
+        rows = self._rows_for(similar_cases)
+        user_args = list(set(user_profile.get("current_arguments", [])))
+        if rows is not None:
+            impacts = self._impacts(user_args, rows)
+        else:
+            counterfactuals = self.counterfactual_analysis(similar_cases)
+            impacts = np.array([
+                counterfactuals[a]["impact"] if a in counterfactuals else np.nan
+                for a in user_args
+            ])
+        # Only positive impacts count, dampened
+        boost = float((np.clip(np.nan_to_num(impacts), 0.0, None) * 0.3).sum())
+
+        adjusted = float(np.clip(base_prob + boost, 0.0, 1.0))
 
         sustained = int(outcomes.sum())
         total = len(similar_cases)
@@ -1,19 +1,160 @@
 """Find similar H-1B cases using combined metadata + embedding similarity."""
 
-import warnings
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy.sparse import csc_matrix
 
-warnings.filterwarnings("ignore", category=RuntimeWarning, module="sklearn")
+from .case_table import CaseTable
+
+try:
+    import faiss
+    HAS_FAISS = True
+except ImportError:
+    HAS_FAISS = False
+
+WAGE_LEVELS = {"level i": 1, "level ii": 2, "level iii": 3, "level iv": 4}
+
+# Metadata field weights; renormalised over the fields both sides have
+TITLE_WEIGHT = 0.30
+COMPANY_WEIGHT = 0.20
+WAGE_WEIGHT = 0.15
+RFE_WEIGHT = 0.35
+FIELD_WEIGHTS = (TITLE_WEIGHT, COMPANY_WEIGHT, WAGE_WEIGHT, RFE_WEIGHT)
+
+# From this many cases the unit embeddings are held as int8 (4x less memory
+# traffic per query); below it float32 is small enough to stream directly
+QUANTIZE_MIN_CASES = 50000
+INT8_SCALE = 127.0
+INT8_BLOCK_ROWS = 8192
+
+# From this many cases (if faiss is installed) a query scores embeddings only
+# for its HNSW neighbours plus the cases whose metadata score could still
+# lift them into the top results, instead of for every case
+ANN_MIN_CASES = 20000
+ANN_CANDIDATES = 512
+
+
+def hnsw_index(vectors):
+    """FAISS HNSW inner-product index over unit float32 rows.
+
+    The index stores 8-bit scalar-quantised codes (1 byte per dimension);
+    it only navigates to candidates, which are then scored exactly from
+    the embedding matrix. Rows are added in blocks so a memory-mapped
+    matrix is never copied whole. GraphBuilder.save_graph persists it.
+    """
+    index = faiss.IndexHNSWSQ(
+        vectors.shape[1], faiss.ScalarQuantizer.QT_8bit, 32, faiss.METRIC_INNER_PRODUCT,
+    )
+    index.hnsw.efConstruction = 200
+    sample = vectors[:: max(1, len(vectors) // 65536)]
+    index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    for start in range(0, len(vectors), INT8_BLOCK_ROWS):
+        index.add(np.ascontiguousarray(vectors[start:start + INT8_BLOCK_ROWS], dtype=np.float32))
+    return index
+
+
+def _label_index(label_lists, n):
+    """Index per-case label lists as (vocab, CSC case x label matrix, row counts)."""
+    vocab = {}
+    rows, cols = [], []
+    for i, labels in enumerate(label_lists):
+        for label in set(labels):
+            rows.append(i)
+            cols.append(vocab.setdefault(label, len(vocab)))
+    matrix = csc_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(n, len(vocab)),
+    )
+    return vocab, matrix, np.asarray(matrix.sum(axis=1)).ravel()
+
+
+def _jaccard(index, query):
+    """Jaccard similarity of a query label set against every indexed case."""
+    vocab, matrix, counts = index
+    cols = [vocab[q] for q in query if q in vocab]
+    inter = np.asarray(matrix[:, cols].sum(axis=1)).ravel()
+    union = counts + len(query) - inter
+    return np.divide(inter, union, out=np.zeros(len(counts)), where=counts > 0)
+
+
+def _top_indices(scores, k):
+    """Indices of the k largest scores in ascending order, ties to the higher index.
+
+    Same result as np.argsort(scores, kind="stable")[-k:] but selects with
+    np.partition in O(N) and sorts only the k winners. Exactly tied scores
+    may therefore come out in a different order than the default argsort.
+    """
+    n = len(scores)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k >= n:
+        return np.argsort(scores, kind="stable")
+    kth = np.partition(scores, n - k)[n - k]
+    above = np.flatnonzero(scores > kth)
+    ties = np.flatnonzero(scores == kth)[len(above) - k:]
+    top = np.concatenate([above, ties])
+    top.sort()
+    return top[np.argsort(scores[top], kind="stable")]
 
 
 class SimilaritySearch:
     """Finds cases most similar to a user's profile."""
 
-    def __init__(self, cases, embeddings):
+    def __init__(self, cases, embeddings, quantize=None, normalized=False, table=None,
+                 ann_index=None):
+        """normalized=True promises unit float32 rows (as GraphBuilder
+        produces); they are then used in place, so a memory-mapped matrix
+        is paged in on demand instead of copied. table is a prebuilt
+        CaseTable for cases, shared with other components. ann_index is a
+        persisted hnsw_index() over the same rows; without one it is built
+        here when faiss is available and the corpus is large enough."""
         self.cases = cases
         self.embeddings = embeddings
 
+        # Unit rows once, so each query's cosine scores are a single GEMV
+        emb = np.asarray(embeddings, dtype=np.float32)
+        if normalized:
+            self._emb_norm = emb
+        else:
+            norms = np.linalg.norm(emb, axis=1, keepdims=True).clip(min=1e-12)
+            self._emb_norm = np.ascontiguousarray(emb / norms)
+        self._ann = None
+        if ann_index is not None and ann_index.ntotal == len(cases):
+            self._ann = ann_index
+        elif HAS_FAISS and len(cases) >= ANN_MIN_CASES:
+            self._ann = hnsw_index(self._emb_norm)
+        if self._ann is not None:
+            self._ann.hnsw.efSearch = ANN_CANDIDATES
+        self._emb_i8 = None
+        if quantize is None:
+            quantize = len(cases) >= QUANTIZE_MIN_CASES
+        if quantize:
+            # Unit rows lie in [-1, 1], so one fixed scale suffices
+            self._emb_i8 = np.rint(self._emb_norm * INT8_SCALE).astype(np.int8)
+            self._emb_norm = None
+
+        # Per-field arrays so metadata scoring is one NumPy pass per query
+        table = table if table is not None else CaseTable.from_cases(cases)
+        self._has_title = table.job_titles != ""
+        self._title_index = _label_index(
+            (t.split() for t in np.char.lower(table.job_titles)), len(table)
+        )
+        self._has_company = table.company_types != ""
+        self._company_lc = np.char.lower(table.company_types)
+        self._has_wage = table.wage_levels != ""
+        wage_keys = np.char.strip(np.char.lower(table.wage_levels))
+        self._wage_codes = np.zeros(len(table), dtype=np.int8)
+        for level, code in WAGE_LEVELS.items():
+            self._wage_codes[wage_keys == level] = code
+
+        # RFE issues as a binary case x issue matrix, column-compressed so a
+        # query reads only the columns (inverted lists) of its own issues
+        self._rfe_index = _label_index(table.rfe_issues, len(table))
+
+        self._field_mask = (
+            self._has_title, self._has_company, self._has_wage, self._rfe_index[2] > 0,
+        )
+        self._full_weight = sum(w * has for w, has in zip(FIELD_WEIGHTS, self._field_mask))
+
     # --- Public API ---
 
     def find_similar_cases(self, user_profile, top_k=20):
@@ -25,30 +166,52 @@ class SimilaritySearch:
         Returns list of case dicts augmented with 'similarity_score'.
         """
         # Step 1: score every case by metadata similarity
-        meta_scores = np.array([
-            self._metadata_similarity(user_profile, c) for c in self.cases
-        ])
+        meta_scores = self._metadata_scores(user_profile)
 
-        # Step 2: build a synthetic query embedding from top metadata matches
+        # Step 2: build a synthetic query embedding from top metadata matches.
+        # Metadata scores tie heavily; keep the default argsort so the same
+        # tied cases make up the centroid as always
         top_meta_idx = np.argsort(meta_scores)[-min(10, len(self.cases)):]
         centroid = self.embeddings[top_meta_idx].mean(axis=0, keepdims=True)
 
-        # Step 3: cosine similarity of centroid vs all embeddings
-        emb_scores = cosine_similarity(centroid, self.embeddings)[0]
+        # Step 3: cosine similarity of centroid vs all embeddings, or with an
+        # HNSW index only vs the cases that can reach the candidate pool
+        c = (centroid[0] / max(np.linalg.norm(centroid[0]), 1e-12)).astype(np.float32)
+        # Candidate pool for step 5; at least one, as the original loop
+        # always returned the top case even for top_k <= 0
+        pool = max(2 * top_k, 1)
+        scored = None
+        if self._ann is not None:
+            emb_scores, scored = self._ann_embedding_scores(c, meta_scores, pool)
+        else:
+            emb_scores = self._embedding_scores(c)
 
         # Step 4: combined score  (60% metadata, 40% embedding)
         # Replace any NaN from embedding issues with 0
         emb_scores = np.nan_to_num(emb_scores, nan=0.0)
         combined = 0.6 * meta_scores + 0.4 * emb_scores
+        if scored is not None:
+            combined[~scored] = -np.inf
 
-        # Step 5: rank, deduplicate, and return top_k
-        ranked_idx = np.argsort(combined)[::-1]
+        # Step 5: rank, deduplicate, and return top_k. Only a candidate
+        # pool is sorted; it doubles if dedup leaves fewer than top_k.
+        while True:
+            results = self._dedup_top(_top_indices(combined, pool)[::-1],
+                                      combined, meta_scores, emb_scores, top_k)
+            if len(results) >= top_k or pool >= len(combined):
+                return results
+            if scored is not None:
+                # Dedup went past the cases scored via the index; score all
+                emb_scores = np.nan_to_num(self._embedding_scores(c), nan=0.0)
+                combined = 0.6 * meta_scores + 0.4 * emb_scores
+                scored = None
+            pool *= 2
 
+    def _dedup_top(self, ranked_idx, combined, meta_scores, emb_scores, top_k):
         results = []
         seen_cases = set()
         for idx in ranked_idx:
             case_num = self.cases[idx].get("case_number") or ""
-            job = self.cases[idx].get("job_title") or ""
             # Dedup by case_number if available, otherwise by index
             dedup_key = case_num if case_num else str(idx)
             if dedup_key in seen_cases:
@@ -66,61 +229,99 @@ class SimilaritySearch:
 
         return results
 
+    def _embedding_scores(self, query, rows=None):
+        """Dot product of every unit case embedding (or those at rows) with a unit query."""
+        if rows is not None:
+            if self._emb_i8 is None:
+                return self._emb_norm[rows] @ query
+            return self._emb_i8[rows].astype(np.float32) @ query / INT8_SCALE
+        if self._emb_i8 is None:
+            return self._emb_norm @ query
+
+        # numpy has no int8 GEMV; upcast one cache-sized block at a time so
+        # only int8 rows are streamed from memory
+        scores = np.empty(len(self._emb_i8), dtype=np.float32)
+        for start in range(0, len(scores), INT8_BLOCK_ROWS):
+            block = self._emb_i8[start:start + INT8_BLOCK_ROWS].astype(np.float32)
+            scores[start:start + INT8_BLOCK_ROWS] = block @ query
+        return scores / INT8_SCALE
+
+    def _ann_embedding_scores(self, query, meta_scores, depth):
+        """Embedding scores for the cases that can make the top `depth`.
+
+        The HNSW neighbours are scored exactly. Every other case has an
+        embedding score at most the last neighbour's, so it is scored too
+        only if its metadata score could still reach the depth-th combined
+        score among the neighbours.
+
+        Returns:
+            tuple: (scores, 0 where unscored; bool mask of scored cases)
+        """
+        sims, ids = self._ann.search(query[None, :], ANN_CANDIDATES)
+        found = ids[0] >= 0
+        ids = ids[0][found]
+        scores = np.zeros(len(meta_scores), dtype=np.float32)
+        scored = np.zeros(len(meta_scores), dtype=bool)
+        scores[ids] = self._embedding_scores(query, ids)
+        scored[ids] = True
+
+        if len(ids) >= depth:
+            combined = 0.6 * meta_scores[ids] + 0.4 * scores[ids]
+            threshold = np.partition(combined, -depth)[-depth]
+            ceiling = 0.6 * meta_scores + 0.4 * sims[0][found][-1]
+            rest = np.flatnonzero((ceiling >= threshold) & ~scored)
+        else:
+            rest = np.flatnonzero(~scored)
+        scores[rest] = self._embedding_scores(query, rest)
+        scored[rest] = True
+        return scores, scored
+
     # --- Metadata similarity components ---
 
-    def _metadata_similarity(self, profile, case):
-        """Weighted combination of per-field similarity scores."""
-        scores = []
-        weights = []
-
-        # Job title (Jaccard on tokens) — weight 0.30
-        if profile.get("job_title") and case.get("job_title"):
-            scores.append(self._job_title_sim(profile["job_title"], case["job_title"]))
-            weights.append(0.30)
-
-        # Company type (exact match) — weight 0.20
-        if profile.get("company_type") and case.get("company_type"):
-            scores.append(1.0 if profile["company_type"].lower() == case["company_type"].lower() else 0.0)
-            weights.append(0.20)
-
-        # Wage level (distance) — weight 0.15
-        if profile.get("wage_level") and case.get("wage_level"):
-            scores.append(self._wage_level_sim(profile["wage_level"], case["wage_level"]))
-            weights.append(0.15)
-
-        # RFE issues (Jaccard) — weight 0.35
-        if profile.get("rfe_issues") and case.get("rfe_issues"):
-            scores.append(self._jaccard(set(profile["rfe_issues"]), set(case["rfe_issues"])))
-            weights.append(0.35)
-
-        if not weights:
-            return 0.0
-
-        # Normalise weights so they sum to 1
-        total_w = sum(weights)
-        return sum(s * w / total_w for s, w in zip(scores, weights))
-
-    @staticmethod
-    def _job_title_sim(a, b):
-        """Token-level Jaccard similarity between two job titles."""
-        ta = set(a.lower().split())
-        tb = set(b.lower().split())
-        if not ta or not tb:
-            return 0.0
-        return len(ta & tb) / len(ta | tb)
-
-    @staticmethod
-    def _wage_level_sim(a, b):
-        """1 - normalised distance between wage levels (0=same, 1=max apart)."""
-        order = {"level i": 1, "level ii": 2, "level iii": 3, "level iv": 4}
-        va = order.get(a.lower().strip(), 0)
-        vb = order.get(b.lower().strip(), 0)
-        if va == 0 or vb == 0:
-            return 0.0
-        return 1.0 - abs(va - vb) / 3.0
-
-    @staticmethod
-    def _jaccard(a, b):
-        if not a and not b:
-            return 0.0
-        return len(a & b) / len(a | b) if (a | b) else 0.0
+    def _metadata_scores(self, profile):
+        """Weighted per-field similarity of every case to the profile.
+
+        Each field counts only where both the profile and the case have it;
+        the weights of the fields that count are normalised to sum to 1.
+        """
+        n = len(self.cases)
+        score_sum = np.zeros(n, dtype=np.float64)
+
+        # Job title (Jaccard on tokens)
+        if profile.get("job_title"):
+            tokens = set(profile["job_title"].lower().split())
+            title_sim = _jaccard(self._title_index, tokens)
+            score_sum += TITLE_WEIGHT * title_sim * self._has_title
+
+        # Company type (exact match)
+        if profile.get("company_type"):
+            match = self._company_lc == profile["company_type"].lower()
+            score_sum += COMPANY_WEIGHT * (match & self._has_company)
+
+        # Wage level (1 - normalised distance; unknown levels score 0)
+        if profile.get("wage_level"):
+            code = WAGE_LEVELS.get(profile["wage_level"].lower().strip(), 0)
+            if code:
+                wage_sim = 1.0 - np.abs(self._wage_codes.astype(np.float64) - code) / 3.0
+                wage_sim[self._wage_codes == 0] = 0.0
+                score_sum += WAGE_WEIGHT * wage_sim * self._has_wage
+
+        # RFE issues (Jaccard)
+        issues = set(profile.get("rfe_issues") or [])
+        if issues:
+            score_sum += RFE_WEIGHT * _jaccard(self._rfe_index, issues)
+
+        # Per-case weight sums depend only on which profile fields are set;
+        # the all-fields case (the usual CLI path) is precomputed at init
+        used = (
+            bool(profile.get("job_title")), bool(profile.get("company_type")),
+            bool(profile.get("wage_level")), bool(issues),
+        )
+        if all(used):
+            weight_sum = self._full_weight
+        else:
+            weight_sum = sum(
+                w * has for w, has, u in zip(FIELD_WEIGHTS, self._field_mask, used) if u
+            )
+
+        return np.divide(score_sum, weight_sum, out=np.zeros(n), where=weight_sum > 0)
@@ -1,13 +1,39 @@
 """Main recommendation engine — orchestrates graph, search, analysis, and viz."""
 
 import json
+import threading
+from collections import Counter, OrderedDict
 from pathlib import Path
 
+import numpy as np
+
+from .case_table import CaseTable
 from .graph_builder import GraphBuilder
 from .similarity_search import SimilaritySearch
 from .pattern_analyzer import PatternAnalyzer
 from .visualizer import GraphVisualizer
 
+# Where recommend_strategy writes the HTML graph unless told otherwise
+DEFAULT_VIZ_PATH = str(Path(__file__).parent.parent / "strategy_recommendation.html")
+
+# Case fields returned in recommendation output
+SLIM_KEYS = (
+    "case_number", "outcome", "job_title", "company_name",
+    "company_type", "wage_level", "rfe_issues", "arguments_made",
+    "similarity_score", "decision_date", "service_center",
+)
+
+# Neighbourhood (similar-case set) analyses kept per engine load
+NEIGHBOURHOOD_CACHE_SIZE = 256
+
+# Per-profile similar-case lists and viz-free recommendations kept per load
+PROFILE_CACHE_SIZE = 1024
+
+
+def _profile_key(user_profile):
+    """Hashable, order-independent key for a user profile dict."""
+    return json.dumps(user_profile, sort_keys=True, default=str)
+
 
 class RecommendationEngine:
     """End-to-end H-1B appeal strategy recommendation system."""
@@ -17,6 +43,13 @@ class RecommendationEngine:
         self.searcher = None
         self.analyzer = None
         self.visualizer = None
+        self._graph_data = None
+        self._assoc_rules = None
+        self._neighbourhood_cache = OrderedDict()
+        self._similar_cache = OrderedDict()
+        self._result_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._slim_by_index = {}
         self._loaded = False
 
     # ------------------------------------------------------------------
@@ -25,9 +58,9 @@ class RecommendationEngine:
 
     def load_from_mongodb(self, uri=None, db_name="rfe_tool",
                           collection_name="cases", similarity_threshold=0.75,
-                          cache_path=None):
+                          cache_path=None, extra_fields=()):
         """Build everything from MongoDB and optionally cache to disk."""
-        self.builder.load_from_mongodb(uri, db_name, collection_name)
+        self.builder.load_from_mongodb(uri, db_name, collection_name, extra_fields)
         self.builder.build_graph(similarity_threshold)
 
         if cache_path:
@@ -35,15 +68,30 @@ class RecommendationEngine:
 
         self._init_components()
 
-    def load_from_cache(self, path="h1b_graph.pkl"):
+    def load_from_cache(self, path="h1b_graph", mmap=True):
         """Load a previously persisted graph."""
-        self.builder.load_graph(path)
+        self.builder.load_graph(path, mmap=mmap)
         self._init_components()
 
     def _init_components(self):
-        self.searcher = SimilaritySearch(self.builder.cases, self.builder.embeddings)
-        self.analyzer = PatternAnalyzer(self.builder.cases, self.builder.G)
-        self.visualizer = GraphVisualizer(self.builder.G, self.builder.cases)
+        self.table = CaseTable.from_cases(self.builder.cases)
+        self.searcher = SimilaritySearch(
+            self.builder.cases, self.builder.embeddings,
+            normalized=self.builder.normalized,
+            ann_index=self.builder.ann_index,
+            table=self.table,
+        )
+        self.analyzer = PatternAnalyzer(self.builder.cases, self.builder.G, table=self.table)
+        self.case_ids = [f"case_{c['index']}" for c in self.builder.cases]
+        self.visualizer = GraphVisualizer(
+            self.builder.G, self.builder.cases, case_ids=self.case_ids,
+        )
+        self._graph_data = None
+        self._assoc_rules = None
+        self._neighbourhood_cache = OrderedDict()
+        self._similar_cache = OrderedDict()
+        self._result_cache = OrderedDict()
+        self._slim_by_index = {}
         self._loaded = True
 
     # ------------------------------------------------------------------
@@ -59,8 +107,9 @@ class RecommendationEngine:
             Keys: job_title, company_type, wage_level, rfe_issues, current_arguments
         top_k : int
             Number of similar cases to consider.
-        viz_path : str | None
-            If set, write interactive HTML graph to this path.
+        viz_path : str | None | False
+            Path for the interactive HTML graph (None: DEFAULT_VIZ_PATH).
+            False skips the visualization; graph_viz_path is then "".
 
         Returns
         -------
@@ -69,52 +118,53 @@ class RecommendationEngine:
         if not self._loaded:
             raise RuntimeError("Call load_from_mongodb() or load_from_cache() first.")
 
+        if viz_path is False:
+            # No file side effect, so the result depends only on the profile
+            result = self._cached(
+                self._result_cache, (_profile_key(user_profile), top_k),
+                PROFILE_CACHE_SIZE,
+                lambda: self._recommend(user_profile, top_k, viz_path),
+            )
+            return dict(result)
+        return self._recommend(user_profile, top_k, viz_path)
+
+    def _recommend(self, user_profile, top_k, viz_path):
         # 1. Find similar cases
-        similar = self.searcher.find_similar_cases(user_profile, top_k=top_k)
+        similar = self._similar_cases(user_profile, top_k)
 
-        # 2. Argument effectiveness in the similar neighbourhood
-        arg_patterns = self.analyzer.analyze_argument_patterns(similar)
+        # 2. Argument effectiveness and counterfactuals (with vs without
+        # each argument) in the similar neighbourhood
+        arg_patterns, counterfactuals = self._neighbourhood_analysis(similar)
 
         # 3. Association rules (full dataset)
-        # Low support threshold needed because SUSTAINED cases are rare
-        # (5/61 = 8.2% max support for any SUSTAINED rule)
-        sustained_count = sum(1 for c in self.builder.cases if c.get("outcome") == "SUSTAINED")
-        min_sup = max(0.03, (sustained_count / len(self.builder.cases)) * 0.5)
-        assoc_rules = self.analyzer.find_association_rules(
-            min_support=min_sup, min_confidence=0.4,
-        )
+        assoc_rules = self._association_rules()
 
-        # 4. Counterfactual (with vs without each argument)
-        counterfactuals = self.analyzer.counterfactual_analysis(similar)
-
-        # 5. Success probability
+        # 4. Success probability
         prob = self.analyzer.calculate_success_probability(user_profile, similar)
 
-        # 6. Build recommendations
+        # 5. Build recommendations
         recommendations = self._build_recommendations(
             user_profile, arg_patterns, counterfactuals, assoc_rules,
         )
 
-        # 7. Risk assessment
-        risk = self._assess_risk(similar, prob)
+        # 6. Risk assessment
+        outcome_counts = Counter(c.get("outcome") for c in similar)
+        risk = self._assess_risk(outcome_counts, prob)
 
-        # 8. Winning patterns
+        # 7. Winning patterns
         winning = self._extract_winning_patterns(similar)
 
-        # 9. Explanation
+        # 8. Explanation
         explanation = self._generate_explanation(
-            user_profile, similar, prob, recommendations, risk,
+            user_profile, similar, prob, recommendations, risk, outcome_counts,
         )
 
-        # 10. Visualization
+        # 9. Visualization
         graph_viz_path = ""
-        if viz_path is None:
-            viz_path = str(
-                Path(__file__).parent.parent / "strategy_recommendation.html"
+        if viz_path is not False:
+            graph_viz_path = self.visualizer.create_strategy_visualization(
+                user_profile, similar, output_path=viz_path or DEFAULT_VIZ_PATH,
             )
-        graph_viz_path = self.visualizer.create_strategy_visualization(
-            user_profile, similar, output_path=viz_path,
-        )
 
         return {
             "similar_cases": self._slim_cases(similar[:10]),
@@ -128,6 +178,59 @@ class RecommendationEngine:
             "graph_viz_path": graph_viz_path,
         }
 
+    def _association_rules(self):
+        """Association rules over the full case set, mined once per load."""
+        if self._assoc_rules is None:
+            # Low support threshold needed because SUSTAINED cases are rare
+            # (5/61 = 8.2% max support for any SUSTAINED rule)
+            sustained_count = int((self.table.outcomes == "SUSTAINED").sum())
+            min_sup = max(0.03, (sustained_count / len(self.builder.cases)) * 0.5)
+            self._assoc_rules = self.analyzer.find_association_rules(
+                min_support=min_sup, min_confidence=0.4,
+            )
+        return self._assoc_rules
+
+    def _neighbourhood_analysis(self, similar):
+        """Argument patterns and counterfactuals for a similar-case set.
+
+        Both depend only on which cases are in the set (and their order), so
+        results are LRU-cached by the tuple of case indices.
+        """
+        return self._cached(
+            self._neighbourhood_cache, tuple(c["index"] for c in similar),
+            NEIGHBOURHOOD_CACHE_SIZE,
+            lambda: (
+                self.analyzer.analyze_argument_patterns(similar),
+                self.analyzer.counterfactual_analysis(similar),
+            ),
+        )
+
+    def _similar_cases(self, user_profile, top_k):
+        """find_similar_cases, LRU-cached per profile (shared with get_graph_data)."""
+        return self._cached(
+            self._similar_cache, (_profile_key(user_profile), top_k),
+            PROFILE_CACHE_SIZE,
+            lambda: self.searcher.find_similar_cases(user_profile, top_k=top_k),
+        )
+
+    def _cached(self, cache, key, size, compute):
+        """LRU lookup in one of the per-load caches; safe across request threads.
+
+        compute runs outside the lock, so two threads missing the same key
+        may both compute it; the second result simply overwrites the first.
+        """
+        with self._cache_lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+                return value
+        value = compute()
+        with self._cache_lock:
+            cache[key] = value
+            if len(cache) > size:
+                cache.popitem(last=False)
+        return value
+
     # ------------------------------------------------------------------
     # Recommendation builder
     # ------------------------------------------------------------------
@@ -136,14 +239,14 @@ class RecommendationEngine:
                                counterfactuals, rules):
         """Rank arguments the user should ADD for highest impact."""
         user_args = set(profile.get("current_arguments", []))
-        recs = []
+        recs = {}  # arg -> recommendation, in insertion order
 
         # Source 1: counterfactual impact
         for arg, stats in counterfactuals.items():
             if arg in user_args:
                 continue  # user already has it
             if stats["impact"] > 0 and stats["with_count"] >= 2:
-                recs.append({
+                recs[arg] = {
                     "add": arg,
                     "impact": f"+{round(stats['impact'] * 100)}% success rate",
                     "impact_raw": stats["impact"],
@@ -151,7 +254,7 @@ class RecommendationEngine:
                     "sample_size": stats["with_count"],
                     "confidence": stats["confidence"],
                     "source": "counterfactual",
-                })
+                }
 
         # Source 2: high-confidence association rules
         for rule in rules:
@@ -163,13 +266,13 @@ class RecommendationEngine:
                 if arg in user_args:
                     continue
                 # avoid duplicates
-                if any(r["add"] == arg for r in recs):
-                    existing = next(r for r in recs if r["add"] == arg)
+                existing = recs.get(arg)
+                if existing is not None:
                     # boost confidence if confirmed by rules
                     if rule["confidence"] > 0.7 and existing["confidence"] in ("low", "very_low"):
                         existing["confidence"] = "medium"
                     continue
-                recs.append({
+                recs[arg] = {
                     "add": arg,
                     "impact": f"appears in {round(rule['confidence'] * 100)}%-confidence winning rule",
                     "impact_raw": rule["confidence"] * 0.5,
@@ -177,9 +280,9 @@ class RecommendationEngine:
                     "sample_size": rule["sample_size"],
                     "confidence": self._conf_label(rule["sample_size"]),
                     "source": "association_rule",
-                })
+                }
 
-        recs.sort(key=lambda r: -r["impact_raw"])
+        recs = sorted(recs.values(), key=lambda r: -r["impact_raw"])
 
         # Clean output
         for r in recs:
@@ -192,10 +295,10 @@ class RecommendationEngine:
     # ------------------------------------------------------------------
 
     @staticmethod
-    def _assess_risk(similar_cases, prob_info):
-        """One-line risk summary."""
-        total = len(similar_cases)
-        dismissed = sum(1 for c in similar_cases if c.get("outcome") == "DISMISSED")
+    def _assess_risk(outcome_counts, prob_info):
+        """One-line risk summary from the similar cases' outcome counts."""
+        total = sum(outcome_counts.values())
+        dismissed = outcome_counts["DISMISSED"]
         pct = round(dismissed / total * 100) if total else 0
         prob_pct = round(prob_info["probability"] * 100)
         return (
@@ -207,30 +310,32 @@ class RecommendationEngine:
     # Winning patterns
     # ------------------------------------------------------------------
 
-    @staticmethod
-    def _extract_winning_patterns(similar_cases):
+    def _extract_winning_patterns(self, similar_cases):
         """Find argument combinations that led to SUSTAINED."""
-        from collections import Counter
-
         sustained = [c for c in similar_cases if c.get("outcome") == "SUSTAINED"]
         if not sustained:
             return []
 
         combo_counter = Counter()
         for c in sustained:
-            args = tuple(sorted(c.get("arguments_made", [])))
+            args = self.table.argument_combos[c["index"]]
             if args:
                 combo_counter[args] += 1
 
+        # Inverted index over dismissed cases: argument -> case positions
+        dismissed_index = {}
+        for i, c in enumerate(similar_cases):
+            if c.get("outcome") == "DISMISSED":
+                for arg in c.get("arguments_made", []):
+                    dismissed_index.setdefault(arg, set()).add(i)
+
         patterns = []
         total_sustained = len(sustained)
         for combo, count in combo_counter.most_common(5):
             # How many dismissed cases also used this combo?
-            dismissed_with = sum(
-                1 for c in similar_cases
-                if c.get("outcome") == "DISMISSED"
-                and set(combo).issubset(set(c.get("arguments_made", [])))
-            )
+            dismissed_with = len(set.intersection(
+                *(dismissed_index.get(arg, set()) for arg in combo)
+            ))
             total_with = count + dismissed_with
             rate = count / total_with if total_with else 0
 
@@ -249,7 +354,7 @@ class RecommendationEngine:
     # ------------------------------------------------------------------
 
     @staticmethod
-    def _generate_explanation(profile, similar, prob, recs, risk):
+    def _generate_explanation(profile, similar, prob, recs, risk, outcome_counts):
         """Human-readable explanation of the recommendation."""
         parts = []
 
@@ -262,12 +367,9 @@ class RecommendationEngine:
 
         parts.append(f"\nRISK: {risk}")
 
-        sustained = sum(1 for c in similar if c.get("outcome") == "SUSTAINED")
-        dismissed = sum(1 for c in similar if c.get("outcome") == "DISMISSED")
-        remanded = sum(1 for c in similar if c.get("outcome") == "REMANDED")
         parts.append(
-            f"\nAmong similar cases: {sustained} sustained, "
-            f"{dismissed} dismissed, {remanded} remanded."
+            f"\nAmong similar cases: {outcome_counts['SUSTAINED']} sustained, "
+            f"{outcome_counts['DISMISSED']} dismissed, {outcome_counts['REMANDED']} remanded."
         )
 
         if recs:
@@ -304,15 +406,19 @@ class RecommendationEngine:
     # Helpers
     # ------------------------------------------------------------------
 
-    @staticmethod
-    def _slim_cases(cases):
-        """Return only the fields useful in JSON output."""
-        keys = [
-            "case_number", "outcome", "job_title", "company_name",
-            "company_type", "wage_level", "rfe_issues", "arguments_made",
-            "similarity_score", "decision_date", "service_center",
-        ]
-        return [{k: c.get(k) for k in keys} for c in cases]
+    def _slim_cases(self, cases):
+        """Return only the fields useful in JSON output.
+
+        The static fields are projected once per case and reused; only
+        similarity_score is filled in per request.
+        """
+        slim = []
+        for c in cases:
+            base = self._slim_by_index.get(c["index"])
+            if base is None:
+                base = self._slim_by_index[c["index"]] = {k: c.get(k) for k in SLIM_KEYS}
+            slim.append({**base, "similarity_score": c.get("similarity_score")})
+        return slim
 
     @staticmethod
     def _conf_label(n):
@@ -339,6 +445,43 @@ class RecommendationEngine:
         if not self._loaded:
             raise RuntimeError("Engine not loaded")
 
+        nodes, edges, centroid = self._static_graph_data()
+
+        # User node position + similar case IDs
+        similar_ids = []
+        user_x, user_y = 0.0, 0.0
+
+        if user_profile and self.searcher:
+            similar = self._similar_cases(user_profile, top_k_highlight)
+            similar_ids = [c["index"] for c in similar]
+
+            top_5 = similar[:5]
+            if top_5:
+                # Similarity-weighted centroid of the top 5 cases
+                xy = np.array(
+                    [(c.get("x_2d", 0), c.get("y_2d", 0)) for c in top_5], dtype=np.float64,
+                )
+                weights = np.array([c.get("similarity_score", 0.5) for c in top_5], dtype=np.float64)
+                user_x, user_y = (weights @ xy / (weights.sum() or 1.0)).tolist()
+        else:
+            user_x, user_y = centroid
+
+        return {
+            "nodes": nodes,
+            "edges": edges,
+            "user_node": {"x": round(user_x, 4), "y": round(user_y, 4)},
+            "similar_ids": similar_ids,
+        }
+
+    def _static_graph_data(self):
+        """Profile-independent part of get_graph_data, built once per load.
+
+        Returns:
+            tuple: (case nodes, deduplicated SIMILAR_TO edges, mean (x, y))
+        """
+        if self._graph_data is not None:
+            return self._graph_data
+
         # 1. All case nodes
         nodes = []
         for case in self.builder.cases:
@@ -357,13 +500,13 @@ class RecommendationEngine:
         # 2. Deduplicated SIMILAR_TO edges
         edges = []
         seen = set()
+        index_of = {cid: i for i, cid in enumerate(self.case_ids)}
         for u, v, data in self.builder.G.edges(data=True):
             if data.get("edge_type") != "SIMILAR_TO":
                 continue
-            if not (str(u).startswith("case_") and str(v).startswith("case_")):
+            u_idx, v_idx = index_of.get(u), index_of.get(v)
+            if u_idx is None or v_idx is None:
                 continue
-            u_idx = int(str(u).split("_")[1])
-            v_idx = int(str(v).split("_")[1])
             pair = (min(u_idx, v_idx), max(u_idx, v_idx))
             if pair in seen:
                 continue
@@ -374,34 +517,12 @@ class RecommendationEngine:
                 "weight": round(data.get("weight", 0), 3),
             })
 
-        # 3. User node position + similar case IDs
-        similar_ids = []
-        user_x, user_y = 0.0, 0.0
-
-        if user_profile and self.searcher:
-            similar = self.searcher.find_similar_cases(
-                user_profile, top_k=top_k_highlight,
+        centroid = (0.0, 0.0)
+        if nodes:
+            centroid = (
+                sum(n["x"] for n in nodes) / len(nodes),
+                sum(n["y"] for n in nodes) / len(nodes),
             )
-            similar_ids = [c["index"] for c in similar]
 
-            top_5 = similar[:5]
-            if top_5:
-                weights = [c.get("similarity_score", 0.5) for c in top_5]
-                total_w = sum(weights) or 1.0
-                user_x = sum(
-                    c.get("x_2d", 0) * w for c, w in zip(top_5, weights)
-                ) / total_w
-                user_y = sum(
-                    c.get("y_2d", 0) * w for c, w in zip(top_5, weights)
-                ) / total_w
-        else:
-            if nodes:
-                user_x = sum(n["x"] for n in nodes) / len(nodes)
-                user_y = sum(n["y"] for n in nodes) / len(nodes)
-
-        return {
-            "nodes": nodes,
-            "edges": edges,
-            "user_node": {"x": round(user_x, 4), "y": round(user_y, 4)},
-            "similar_ids": similar_ids,
-        }
+        self._graph_data = (nodes, edges, centroid)
+        return self._graph_data
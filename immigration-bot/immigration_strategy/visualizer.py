@@ -1,6 +1,40 @@
-"""Interactive graph visualization using pyvis."""
-
-from pyvis.network import Network
+"""Interactive graph visualization rendered straight to a vis-network page."""
+
+from collections import Counter
+from pathlib import Path
+from string import Template
+
+import numpy as np
+import orjson
+
+
+def _script_json(obj):
+    """JSON for inlining in a <script> block (HTML-significant chars escaped)."""
+    return (
+        orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+        .replace("<", "\\u003c").replace(">", "\\u003e").replace("&", "\\u0026")
+    )
+
+
+# Static HTML page; nodes, edges and options are substituted in as JSON
+VIZ_TEMPLATE = Template((Path(__file__).parent / "viz_shell.html").read_text())
+FONT_COLOR = "white"
+VIS_OPTIONS = {
+    "interaction": {
+        "hover": True,
+        "tooltipDelay": 100,
+        "navigationButtons": True,
+    },
+    "physics": {
+        "barnesHut": {
+            "gravitationalConstant": -3000,
+            "springLength": 150,
+        },
+        "stabilization": {"iterations": 200},
+    },
+}
+# Same for every page, so serialised once
+VIS_OPTIONS_JSON = _script_json(VIS_OPTIONS)
 
 
 # Outcome colours
@@ -29,9 +63,16 @@ NODE_TYPE_SHAPES = {
 class GraphVisualizer:
     """Creates interactive HTML visualizations of the strategy graph."""
 
-    def __init__(self, graph, cases):
+    def __init__(self, graph, cases, case_ids=None):
         self.G = graph
         self.cases = cases
+        # Graph node ids, built once: case_ids[i] is the node of case index i
+        self.case_ids = case_ids if case_ids is not None else [
+            f"case_{c['index']}" for c in cases
+        ]
+        self.arg_ids = {
+            a: f"arg_{a}" for c in cases for a in c.get("arguments_made") or []
+        }
 
     def create_strategy_visualization(self, user_profile, similar_cases,
                                       output_path="strategy_recommendation.html"):
@@ -39,14 +80,20 @@ class GraphVisualizer:
 
         Returns the path to the generated HTML file.
         """
-        net = Network(
-            height="900px", width="100%", bgcolor="#1a1a2e",
-            font_color="white", directed=False, notebook=False,
-        )
-        net.barnes_hut(
-            gravity=-3000, central_gravity=0.3,
-            spring_length=150, spring_strength=0.05,
-        )
+        nodes = {}  # node id -> vis.js options; the first add of an id wins
+        edges = []
+        linked = set()
+
+        def add_node(node_id, **attrs):
+            if node_id not in nodes:
+                nodes[node_id] = {"id": node_id, "font": {"color": FONT_COLOR}, **attrs}
+
+        def add_edge(source, target, **attrs):
+            # Undirected: one edge per unordered pair
+            pair = frozenset((source, target))
+            if pair not in linked:
+                linked.add(pair)
+                edges.append({"from": source, "to": target, **attrs})
 
         # --- Central USER node ---
         user_label = (
@@ -54,19 +101,21 @@ class GraphVisualizer:
             f"({user_profile.get('company_type', '')}, "
             f"{user_profile.get('wage_level', '')})"
         )
-        net.add_node(
+        add_node(
             "USER", label=user_label, color="#00bfff", shape="star",
             size=40, borderWidth=3, font={"size": 16, "color": "white"},
             title=self._user_tooltip(user_profile),
         )
 
+        outcome_color = OUTCOME_COLORS.get
+
         # --- Similar case nodes ---
         added_cases = set()
         for case in similar_cases:
-            cid = f"case_{case['index']}"
+            cid = self.case_ids[case["index"]]
             added_cases.add(cid)
             outcome = case.get("outcome", "UNKNOWN")
-            color = OUTCOME_COLORS.get(outcome, "#888888")
+            color = outcome_color(outcome, "#888888")
             sim = case.get("similarity_score", 0)
 
             title_lines = [
@@ -84,7 +133,7 @@ class GraphVisualizer:
             if len(label) > 20:
                 label = label[:17] + "..."
 
-            net.add_node(
+            add_node(
                 cid, label=label, color=color,
                 shape="dot", size=15 + sim * 20,
                 borderWidth=2,
@@ -92,40 +141,42 @@ class GraphVisualizer:
             )
 
             # Edge from USER to case
-            net.add_edge(
+            add_edge(
                 "USER", cid,
                 value=sim, color={"color": "#ffffff44"},
                 title=f"Similarity: {sim:.2f}",
             )
 
         # --- Argument nodes for similar cases ---
-        arg_outcomes = {}  # arg -> {SUSTAINED: n, DISMISSED: n}
+        # One pass tallies outcomes and collects each argument's case links
+        arg_outcomes = {}  # arg -> Counter({SUSTAINED: n, DISMISSED: n, ...})
+        arg_links = {}  # arg -> (case id, edge colour) of cases that made it
         for case in similar_cases:
             outcome = case.get("outcome", "")
+            link = (self.case_ids[case["index"]], outcome_color(outcome, "#888") + "66")
             for arg in case.get("arguments_made", []):
-                if arg not in arg_outcomes:
-                    arg_outcomes[arg] = {"SUSTAINED": 0, "DISMISSED": 0, "REMANDED": 0}
-                arg_outcomes[arg][outcome] = arg_outcomes[arg].get(outcome, 0) + 1
+                arg_outcomes.setdefault(arg, Counter())[outcome] += 1
+                links = arg_links.setdefault(arg, [])
+                if not links or links[-1] is not link:
+                    links.append(link)
 
         user_args = set(user_profile.get("current_arguments", []))
 
-        for arg, stats in arg_outcomes.items():
-            aid = f"arg_{arg}"
-            total = sum(stats.values())
-            sust = stats.get("SUSTAINED", 0)
-            rate = sust / total if total else 0
-
-            # Color: green if high success, red if low
-            if rate >= 0.6:
-                color = "#00ff88"
-            elif rate >= 0.3:
-                color = "#ffcc00"
-            else:
-                color = "#ff4466"
-
-            border = "#00bfff" if arg in user_args else "#ffffff44"
+        # Success rates and colours for all arguments at once:
+        # green if high success, amber if middling, red if low
+        args = list(arg_outcomes)
+        totals = np.array([sum(arg_outcomes[a].values()) for a in args], dtype=np.int64)
+        susts = np.array([arg_outcomes[a]["SUSTAINED"] for a in args], dtype=np.int64)
+        rates = np.divide(susts, totals, out=np.zeros(len(args)), where=totals > 0)
+        colors = np.select(
+            [rates >= 0.6, rates >= 0.3], ["#00ff88", "#ffcc00"], "#ff4466",
+        )
 
-            net.add_node(
+        for arg, total, sust, rate, color in zip(
+            args, totals.tolist(), susts.tolist(), rates.tolist(), colors.tolist(),
+        ):
+            aid = self.arg_ids.get(arg) or f"arg_{arg}"
+            add_node(
                 aid, label=arg.replace("_", " ").title(),
                 color=color, shape="diamond", size=12 + total * 2,
                 borderWidth=3 if arg in user_args else 1,
@@ -138,31 +189,24 @@ class GraphVisualizer:
             )
 
             # Connect argument to cases that used it
-            for case in similar_cases:
-                if arg in case.get("arguments_made", []):
-                    cid = f"case_{case['index']}"
-                    outcome_color = OUTCOME_COLORS.get(case.get("outcome", ""), "#888")
-                    net.add_edge(
-                        cid, aid,
-                        color={"color": outcome_color + "66"},
-                        width=1, arrows="",
-                    )
+            for cid, edge_color in arg_links[arg]:
+                add_edge(
+                    cid, aid,
+                    color={"color": edge_color},
+                    width=1, arrows="",
+                )
 
         # --- SIMILAR_TO edges between cases ---
-        for case_a in similar_cases:
-            for case_b in similar_cases:
-                a_id = f"case_{case_a['index']}"
-                b_id = f"case_{case_b['index']}"
-                if a_id >= b_id:
-                    continue
-                if self.G.has_edge(a_id, b_id):
-                    edge_data = self.G[a_id][b_id]
-                    if edge_data.get("edge_type") == "SIMILAR_TO":
-                        net.add_edge(
-                            a_id, b_id,
-                            color={"color": "#ffffff22"}, width=1,
-                            title=f"Cosine sim: {edge_data.get('weight', 0):.2f}",
-                        )
+        # Walk the out-edges of the shown cases rather than probing every
+        # pair; SIMILAR_TO is stored once per pair, in either direction
+        for u, v, edge_data in self.G.edges(added_cases, data=True):
+            if v in added_cases and edge_data.get("edge_type") == "SIMILAR_TO":
+                a_id, b_id = sorted((u, v))
+                add_edge(
+                    a_id, b_id,
+                    color={"color": "#ffffff22"}, width=1,
+                    title=f"Cosine sim: {edge_data.get('weight', 0):.2f}",
+                )
 
         # --- Legend via hidden nodes ---
         legend_x, legend_y = -800, -400
@@ -175,30 +219,17 @@ class GraphVisualizer:
             ("Argument (low win)", "#ff4466", "diamond"),
         ]
         for i, (label, color, shape) in enumerate(legend_items):
-            net.add_node(
+            add_node(
                 f"legend_{i}", label=label, color=color, shape=shape,
                 size=10, x=legend_x, y=legend_y + i * 50,
                 physics=False, font={"size": 12, "color": "white"},
             )
 
-        net.set_options("""
-        {
-          "interaction": {
-            "hover": true,
-            "tooltipDelay": 100,
-            "navigationButtons": true
-          },
-          "physics": {
-            "barnesHut": {
-              "gravitationalConstant": -3000,
-              "springLength": 150
-            },
-            "stabilization": {"iterations": 200}
-          }
-        }
-        """)
-
-        net.save_graph(output_path)
+        Path(output_path).write_text(VIZ_TEMPLATE.substitute(
+            nodes=_script_json(list(nodes.values())),
+            edges=_script_json(edges),
+            options=VIS_OPTIONS_JSON,
+        ))
         print(f"Visualization saved to {output_path}")
         return output_path
 
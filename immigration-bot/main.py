@@ -1,29 +1,45 @@
 """FastAPI backend for immigration document assistant."""
 
 import os
+import re
+import asyncio
+import hashlib
+import tempfile
 import logging
+import logging.handlers
+import queue
+import atexit
 import uuid
 import urllib.parse
+from collections import OrderedDict
 from pathlib import Path
 from typing import List, Optional
 
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse, Response
+import orjson
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 from immigration_strategy import RecommendationEngine
 
-from state import (State, Session, get_session, reset_session, MCLOVIN_PROFILE,
-                   build_fill_instructions, extract_investigation_profile)
+from state import (State, Session, get_session, save_session, reset_session, MCLOVIN_PROFILE,
+                   REDIS_URL, build_fill_instructions, extract_investigation_profile)
 from services import parse_form, identify_form, fill_form, download_filled_pdf, chat
 from db import ping_db
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(name)s [%(levelname)s] %(message)s",
-)
+# Configure logging: handlers on the request path only enqueue records, and a
+# listener thread does the formatting and stderr writes off the event loop
+_log_queue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(name)s [%(levelname)s] %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream, respect_handler_level=True)
+_log_handler = logging.handlers.QueueHandler(_log_queue)
+_log_handler.setFormatter(logging.Formatter("%(message)s"))  # listener adds the prefix
+logging.basicConfig(level=logging.INFO, handlers=[_log_handler])
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Pumpkin 🎃 - Immigration Assistant")
@@ -32,6 +48,18 @@ app = FastAPI(title="Pumpkin 🎃 - Immigration Assistant")
 DOWNLOADS_DIR = Path(__file__).parent / "downloads"
 DOWNLOADS_DIR.mkdir(exist_ok=True)
 
+# When set (e.g. "/_dl/"), /download hands the file to nginx via X-Accel-Redirect
+# instead of streaming it through the worker. Needs a matching internal location:
+#   location /_dl/ { internal; alias /path/to/immigration-bot/downloads/; }
+DOWNLOAD_ACCEL_PREFIX = os.environ.get("DOWNLOAD_ACCEL_PREFIX")
+
+# Read size when spooling uploads to disk
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# (parsed_text, form_type) by upload content hash, so re-uploads skip Reducto/OpenAI
+PARSE_CACHE_SIZE = 256
+_parse_cache = OrderedDict()
+
 # Mount frontend static files
 FRONTEND_DIR = Path(__file__).parent / "frontend"
 if FRONTEND_DIR.exists():
@@ -39,15 +67,18 @@ if FRONTEND_DIR.exists():
 
 # Strategy engine (loaded once at startup)
 strategy_engine = RecommendationEngine()
-STRATEGY_CACHE = Path(__file__).parent / "immigration_strategy" / "h1b_graph.pkl"
+STRATEGY_CACHE = Path(__file__).parent / "immigration_strategy" / "h1b_graph"
 
 
 @app.on_event("startup")
 async def startup():
-    ping_db()
+    # Connectivity check only logs; don't hold up startup on the Mongo handshake
+    asyncio.get_running_loop().run_in_executor(None, ping_db)
     try:
         strategy_engine.load_from_cache(str(STRATEGY_CACHE))
         logger.info("Strategy engine loaded (%d cases)", len(strategy_engine.builder.cases))
+        # Warm the engine's per-profile caches for the demo profile
+        strategy_engine.recommend_strategy(DEFAULT_INVESTIGATION_PROFILE, top_k=20, viz_path=False)
     except Exception as e:
         logger.warning("Strategy engine not available: %s", e)
 
@@ -75,18 +106,22 @@ async def index():
     return FileResponse(FRONTEND_DIR / "index.html")
 
 
+# "Send to candidate" phrases, compiled once into a single alternation
+SEND_PATTERNS = [
+    "send it to", "send to candidate", "send to the candidate",
+    "cool send", "send report", "email the candidate", "send the report",
+]
+SEND_INTENT_RE = re.compile("|".join(map(re.escape, SEND_PATTERNS)))
+
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(req: ChatRequest):
     """Handle chat messages."""
-    session = get_session(req.session_id)
+    session = await get_session(req.session_id)
     msg_lower = req.message.lower().strip()
 
     # ── "Send to candidate" intent ──
-    send_patterns = [
-        "send it to", "send to candidate", "send to the candidate",
-        "cool send", "send report", "email the candidate", "send the report",
-    ]
-    is_send = any(p in msg_lower for p in send_patterns)
+    is_send = SEND_INTENT_RE.search(msg_lower) is not None
 
     if is_send and session.investigation_result:
         candidate_email = MCLOVIN_PROFILE.get("email", "mclovin@hawaii.gov")
@@ -107,6 +142,7 @@ async def chat_endpoint(req: ChatRequest):
         session.additional_context = req.message
         if session.investigation_profile:
             session.investigation_profile["additional_context"] = req.message
+        await save_session(req.session_id, session)
         return ChatResponse(
             response=(
                 "Got it, I've noted that additional context. Hit the "
@@ -120,7 +156,8 @@ async def chat_endpoint(req: ChatRequest):
     if session.form_type:
         context += f"\nUser uploaded form: {session.form_type}"
 
-    response = chat(req.message, context)
+    # Blocking OpenAI call; keep it off the event loop
+    response = await run_in_threadpool(chat, req.message, context)
     return ChatResponse(response=response, state=session.state.value)
 
 
@@ -149,6 +186,57 @@ DEMO_PROFILE_TEXT = (
 )
 
 
+def _frozen_upload_response(response: str, state: State, ready_to_investigate: bool = False) -> bytes:
+    """Serialise a constant UploadResponse body once, at import."""
+    return orjson.dumps({
+        "response": response,
+        "state": state.value,
+        "file_url": None,
+        "ready_to_investigate": ready_to_investigate,
+    })
+
+
+def _json(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
+
+
+# Upload replies that never vary, pre-encoded so the demo path skips model
+# validation and serialisation
+RESP_DEMO_RFE = _frozen_upload_response(
+    "Got it! I've received the **Request for Evidence (RFE)** "
+    "for case WAC-25-123-45678.\n\n"
+    "Now upload the **Candidate Profile** so I can cross-reference "
+    "both documents for the analysis.",
+    State.RFE_UPLOADED,
+)
+RESP_DEMO_PROFILE_READY = _frozen_upload_response(
+    "Got the **Candidate Profile** for McLovin!\n\n"
+    "I now have both documents. Type any additional context "
+    "in the chat, or hit the **Investigate** button to start "
+    "the analysis.",
+    State.PROFILE_UPLOADED,
+    ready_to_investigate=True,
+)
+RESP_PROFILE_READY = _frozen_upload_response(
+    "Got the **Candidate Profile** too!\n\n"
+    "I now have both documents. Type any additional context "
+    "in the chat, or hit the **Investigate** button to start "
+    "the analysis.",
+    State.PROFILE_UPLOADED,
+    ready_to_investigate=True,
+)
+RESP_PROFILE_FIRST = _frozen_upload_response(
+    "Got the **Candidate Profile**!\n\n"
+    "Now upload the **RFE document** so I can analyze it.",
+    State.RFE_UPLOADED,
+)
+RESP_LICENSE_RECEIVED = _frozen_upload_response(
+    "Got your Driver's License!\n\n"
+    "Now upload your Social Security Card and I'll fill out your form.",
+    State.WAITING_FOR_SSN,
+)
+
+
 def _classify_upload(filename: str, parsed_text: str) -> str:
     """Classify an uploaded document as 'rfe', 'profile', or 'form'."""
     fn_lower = filename.lower()
@@ -171,18 +259,47 @@ def _is_demo_doc(filename: str) -> Optional[str]:
     return None
 
 
+async def _spool_upload(file: UploadFile, filename: str) -> tuple[Path, str]:
+    """Copy an upload to a temp file in chunks, never holding the whole PDF in memory.
+
+    Returns:
+        The temp file path and a content digest for _parse_upload's cache
+    """
+    suffix = Path(filename).suffix or ".pdf"
+    digest = hashlib.blake2b(digest_size=16)
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            tmp.write(chunk)
+            digest.update(chunk)
+    return Path(tmp.name), digest.hexdigest()
+
+
+async def _parse_upload(path: Path, filename: str, digest: str) -> tuple[str, str]:
+    """Parse and identify an upload, reusing the result for identical content."""
+    if digest in _parse_cache:
+        _parse_cache.move_to_end(digest)
+        return _parse_cache[digest]
+    # Reducto/OpenAI calls block for seconds; run them in the threadpool
+    parsed_text = await run_in_threadpool(parse_form, path, filename)
+    form_type = await run_in_threadpool(identify_form, parsed_text)
+    _parse_cache[digest] = (parsed_text, form_type)
+    if len(_parse_cache) > PARSE_CACHE_SIZE:
+        _parse_cache.popitem(last=False)
+    return parsed_text, form_type
+
+
 @app.post("/upload", response_model=UploadResponse)
 async def upload_endpoint(
     file: UploadFile = File(...),
     session_id: str = Form("default")
 ):
     """Handle file uploads with state-dependent logic."""
-    session = get_session(session_id)
-    file_bytes = await file.read()
+    session = await get_session(session_id)
     filename = file.filename or "document.pdf"
+    upload_path, digest = await _spool_upload(file, filename)
 
-    logger.info("Upload received: %s (%d bytes), state: %s",
-                filename, len(file_bytes), session.state.value)
+    logger.debug("Upload received: %s (%d bytes), state: %s",
+                filename, upload_path.stat().st_size, session.state.value)
 
     try:
         # ── Demo bypass: skip API calls for known sample docs ──
@@ -191,16 +308,8 @@ async def upload_endpoint(
             if demo_type == "rfe":
                 session.rfe_text = DEMO_RFE_TEXT
                 session.state = State.RFE_UPLOADED
-                logger.info("Demo RFE loaded (bypassed API)")
-                return UploadResponse(
-                    response=(
-                        "Got it! I've received the **Request for Evidence (RFE)** "
-                        "for case WAC-25-123-45678.\n\n"
-                        "Now upload the **Candidate Profile** so I can cross-reference "
-                        "both documents for the analysis."
-                    ),
-                    state=session.state.value,
-                )
+                logger.debug("Demo RFE loaded (bypassed API)")
+                return _json(RESP_DEMO_RFE)
             else:  # profile
                 session.profile_text = DEMO_PROFILE_TEXT
                 if session.state == State.RFE_UPLOADED:
@@ -208,31 +317,15 @@ async def upload_endpoint(
                     session.investigation_profile = extract_investigation_profile(
                         session.rfe_text or "", session.profile_text
                     )
-                    logger.info("Demo profile loaded, ready to investigate")
-                    return UploadResponse(
-                        response=(
-                            "Got the **Candidate Profile** for McLovin!\n\n"
-                            "I now have both documents. Type any additional context "
-                            "in the chat, or hit the **Investigate** button to start "
-                            "the analysis."
-                        ),
-                        state=session.state.value,
-                        ready_to_investigate=True,
-                    )
+                    logger.debug("Demo profile loaded, ready to investigate")
+                    return _json(RESP_DEMO_PROFILE_READY)
                 else:
                     session.state = State.RFE_UPLOADED
-                    logger.info("Demo profile loaded first, waiting for RFE")
-                    return UploadResponse(
-                        response=(
-                            "Got the **Candidate Profile**!\n\n"
-                            "Now upload the **RFE document** so I can analyze it."
-                        ),
-                        state=session.state.value,
-                    )
+                    logger.debug("Demo profile loaded first, waiting for RFE")
+                    return _json(RESP_PROFILE_FIRST)
 
         # ── Try to classify via API for non-demo docs ──
-        parsed_text = parse_form(file_bytes, filename)
-        form_type = identify_form(parsed_text)
+        parsed_text, form_type = await _parse_upload(upload_path, filename, digest)
         doc_class = _classify_upload(filename, parsed_text)
 
         # ── RFE investigation flow ──
@@ -256,29 +349,14 @@ async def upload_endpoint(
                 session.investigation_profile = extract_investigation_profile(
                     session.rfe_text or "", session.profile_text
                 )
-                return UploadResponse(
-                    response=(
-                        "Got the **Candidate Profile** too!\n\n"
-                        "I now have both documents. Type any additional context "
-                        "in the chat, or hit the **Investigate** button to start "
-                        "the analysis."
-                    ),
-                    state=session.state.value,
-                    ready_to_investigate=True,
-                )
+                return _json(RESP_PROFILE_READY)
             else:
                 session.state = State.RFE_UPLOADED
-                return UploadResponse(
-                    response=(
-                        "Got the **Candidate Profile**!\n\n"
-                        "Now upload the **RFE document** so I can analyze it."
-                    ),
-                    state=session.state.value,
-                )
+                return _json(RESP_PROFILE_FIRST)
 
         # ── Existing I-9 flow (unchanged) ──
         if session.state == State.WAITING_FOR_FORM:
-            session.form_bytes = file_bytes
+            session.form_path = str(upload_path)
             session.form_filename = filename
             session.form_type = form_type
             session.state = State.WAITING_FOR_LICENSE
@@ -294,21 +372,26 @@ async def upload_endpoint(
 
         elif session.state == State.WAITING_FOR_LICENSE:
             session.state = State.WAITING_FOR_SSN
-            response = (
-                "Got your Driver's License!\n\n"
-                "Now upload your Social Security Card and I'll fill out your form."
-            )
-            return UploadResponse(response=response, state=session.state.value)
+            return _json(RESP_LICENSE_RECEIVED)
 
         elif session.state == State.WAITING_FOR_SSN:
             session.state = State.FILLING
-            if not session.form_bytes:
+            if not session.form_path:
                 raise HTTPException(status_code=400, detail="No form stored in session")
             fill_instructions = build_fill_instructions(MCLOVIN_PROFILE)
-            filled_url = fill_form(session.form_bytes, session.form_filename, fill_instructions)
             filled_filename = f"filled_{uuid.uuid4().hex[:8]}.pdf"
             filled_path = DOWNLOADS_DIR / filled_filename
-            download_filled_pdf(filled_url, filled_path)
+            try:
+                filled_url = await run_in_threadpool(
+                    fill_form, session.form_path, session.form_filename, fill_instructions
+                )
+                await download_filled_pdf(filled_url, filled_path)
+            finally:
+                # The spooled form is spent either way (FILLING doesn't retry);
+                # drop it now rather than leaving it until a reset that an
+                # expired Redis session never gets
+                Path(session.form_path).unlink(missing_ok=True)
+                session.form_path = None
             session.filled_pdf_path = str(filled_path)
             session.state = State.DONE
             response = (
@@ -322,11 +405,10 @@ async def upload_endpoint(
             )
 
         elif session.state == State.DONE:
-            session = reset_session(session_id)
+            session = await reset_session(session_id)
             session.state = State.WAITING_FOR_FORM
-            parsed_text = parse_form(file_bytes, filename)
-            form_type = identify_form(parsed_text)
-            session.form_bytes = file_bytes
+            parsed_text, form_type = await _parse_upload(upload_path, filename, digest)
+            session.form_path = str(upload_path)
             session.form_filename = filename
             session.form_type = form_type
             session.state = State.WAITING_FOR_LICENSE
@@ -351,6 +433,11 @@ async def upload_endpoint(
             response=f"Sorry, I had trouble processing that file: {str(e)}",
             state=session.state.value
         )
+    finally:
+        # Keep the spooled file only if it's the form awaiting filling
+        if session.form_path != str(upload_path):
+            upload_path.unlink(missing_ok=True)
+        await save_session(session_id, session)
 
 
 @app.get("/download/{filename}")
@@ -360,7 +447,14 @@ async def download_file(filename: str):
     
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="File not found")
-    
+
+    if DOWNLOAD_ACCEL_PREFIX:
+        # nginx sends the file; the worker is free as soon as headers go out
+        return Response(headers={
+            "X-Accel-Redirect": f"{DOWNLOAD_ACCEL_PREFIX}{filename}",
+            "Content-Type": "application/pdf",
+            "Content-Disposition": f'attachment; filename="{filename}"',
+        })
     return FileResponse(
         file_path,
         media_type="application/pdf",
@@ -371,7 +465,7 @@ async def download_file(filename: str):
 @app.post("/reset")
 async def reset_endpoint(session_id: str = Form("default")):
     """Reset a session."""
-    reset_session(session_id)
+    await reset_session(session_id)
     return {"status": "reset", "state": State.WAITING_FOR_FORM.value}
 
 
@@ -382,33 +476,44 @@ class InvestigateRequest(BaseModel):
     session_id: str = "default"
 
 
+DEFAULT_INVESTIGATION_PROFILE = {
+    "job_title": MCLOVIN_PROFILE["job_title"],
+    "company_type": MCLOVIN_PROFILE["company_type"],
+    "wage_level": MCLOVIN_PROFILE["wage_level"],
+    "rfe_issues": MCLOVIN_PROFILE["rfe_issues"],
+    "current_arguments": MCLOVIN_PROFILE["current_arguments"],
+}
+
+
+def _investigation_profile(session: Session) -> dict:
+    """Session profile if available (from uploaded docs), else McLovin default."""
+    if session.investigation_profile:
+        return {k: v for k, v in session.investigation_profile.items()
+                if k != "additional_context"}
+    return dict(DEFAULT_INVESTIGATION_PROFILE)
+
+
 @app.post("/api/investigate")
 async def investigate_endpoint(req: InvestigateRequest):
     """Run H-1B strategy investigation."""
     if not strategy_engine._loaded:
         return {"success": False, "error": "Strategy engine not loaded. Graph cache missing."}
 
-    session = get_session(req.session_id)
+    session = await get_session(req.session_id)
 
-    # Use session profile if available (from uploaded docs), else McLovin default
-    if session.investigation_profile:
-        profile = {k: v for k, v in session.investigation_profile.items()
-                   if k != "additional_context"}
-    else:
-        profile = {
-            "job_title": MCLOVIN_PROFILE["job_title"],
-            "company_type": MCLOVIN_PROFILE["company_type"],
-            "wage_level": MCLOVIN_PROFILE["wage_level"],
-            "rfe_issues": MCLOVIN_PROFILE["rfe_issues"],
-            "current_arguments": MCLOVIN_PROFILE["current_arguments"],
-        }
+    profile = _investigation_profile(session)
 
     try:
-        result = strategy_engine.recommend_strategy(profile, top_k=20)
+        # CPU-bound on a cache miss; the engine caches results per profile
+        result = await run_in_threadpool(
+            strategy_engine.recommend_strategy, profile, top_k=20, viz_path=False,
+        )
         result.pop("graph_viz_path", None)
         session.investigation_result = result
         session.state = State.RESULTS_READY
-        return {
+        await save_session(req.session_id, session)
+        # orjson directly, skipping jsonable_encoder's walk of the result
+        return ORJSONResponse({
             "success": True,
             "data": result,
             "profile_summary": {
@@ -417,7 +522,7 @@ async def investigate_endpoint(req: InvestigateRequest):
                 "wage_level": profile.get("wage_level", ""),
                 "has_uploaded_docs": session.rfe_text is not None,
             },
-        }
+        })
     except Exception as e:
         logger.error("Investigation failed: %s", e)
         return {"success": False, "error": str(e)}
@@ -429,23 +534,14 @@ async def graph_data_endpoint(req: InvestigateRequest):
     if not strategy_engine._loaded:
         return {"success": False, "error": "Strategy engine not loaded."}
 
-    session = get_session(req.session_id)
+    session = await get_session(req.session_id)
 
-    if session.investigation_profile:
-        profile = {k: v for k, v in session.investigation_profile.items()
-                   if k != "additional_context"}
-    else:
-        profile = {
-            "job_title": MCLOVIN_PROFILE["job_title"],
-            "company_type": MCLOVIN_PROFILE["company_type"],
-            "wage_level": MCLOVIN_PROFILE["wage_level"],
-            "rfe_issues": MCLOVIN_PROFILE["rfe_issues"],
-            "current_arguments": MCLOVIN_PROFILE["current_arguments"],
-        }
+    profile = _investigation_profile(session)
 
     try:
         data = strategy_engine.get_graph_data(user_profile=profile, top_k_highlight=20)
-        return {"success": True, "data": data, "profile": profile}
+        # Every case node and edge goes out; orjson skips jsonable_encoder's walk
+        return ORJSONResponse({"success": True, "data": data, "profile": profile})
     except Exception as e:
         logger.error("Graph data error: %s", e)
         return {"success": False, "error": str(e)}
@@ -469,4 +565,10 @@ async def send_report_endpoint(req: SendReportRequest):
 if __name__ == "__main__":
     import uvicorn
     logger.info("🎃 Starting Pumpkin Immigration Assistant...")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Workers only share sessions through Redis, so default to 2*cores+1 only
+    # when REDIS_URL is set. loop/http "auto" pick uvloop and httptools
+    # (installed by uvicorn[standard]) when available.
+    default_workers = 2 * (os.cpu_count() or 1) + 1 if REDIS_URL else 1
+    uvicorn.run("main:app", host="0.0.0.0", port=8000,
+                loop="auto", http="auto",
+                workers=int(os.environ.get("WEB_CONCURRENCY", default_workers)))
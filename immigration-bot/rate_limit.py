@@ -0,0 +1,63 @@
+"""Client-side pacing to OpenAI tokens- and requests-per-minute limits."""
+
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """Thread-safe buckets pacing requests to tokens- and requests-per-minute limits.
+
+    Use acquire() from worker threads and acquire_async() from coroutines;
+    both draw from the same buckets.
+    """
+
+    def __init__(self, tokens_per_minute, requests_per_minute=None):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0  # tokens refilled per second
+        self.tokens = float(tokens_per_minute)
+        self.request_capacity = requests_per_minute
+        if requests_per_minute:
+            self.request_rate = requests_per_minute / 60.0
+            self.requests = float(requests_per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        if self.request_capacity:
+            self.requests = min(self.request_capacity, self.requests + elapsed * self.request_rate)
+        self.updated = now
+
+    def _take(self, tokens):
+        """Take `tokens` and one request if available; else return seconds to wait."""
+        with self.lock:
+            self._refill()
+            wait = max(0.0, (tokens - self.tokens) / self.rate)
+            if self.request_capacity:
+                wait = max(wait, (1 - self.requests) / self.request_rate)
+            if wait == 0.0:
+                self.tokens -= tokens
+                if self.request_capacity:
+                    self.requests -= 1
+            return wait
+
+    def acquire(self, tokens):
+        """Block until `tokens` and one request are available, then take them."""
+        tokens = min(tokens, self.capacity)
+        while wait := self._take(tokens):
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens):
+        """Like acquire(), but sleeps without blocking the event loop."""
+        tokens = min(tokens, self.capacity)
+        while wait := self._take(tokens):
+            await asyncio.sleep(wait)
+
+    def release(self, tokens):
+        """Give back tokens taken for a request the API rejected (HTTP 429)."""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + tokens)
@@ -2,17 +2,17 @@
 
 import os
 import logging
-import tempfile
 from pathlib import Path
 
+import httpx
 import requests
 from reducto import Reducto
 from openai import OpenAI
-from dotenv import load_dotenv
+
+from _env import load_env
 
 # Load environment variables from parent directory
-env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(env_path)
+env_path = load_env()
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 REDUCTO_API_KEY = os.environ.get("REDUCTO_API_KEY")
@@ -24,6 +24,9 @@ if not OPENAI_API_KEY or not REDUCTO_API_KEY:
 
 logger = logging.getLogger(__name__)
 
+# Read size when streaming filled PDFs to disk
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
 # Lazy-initialized clients
 _reducto_client = None
 _openai_client = None
@@ -51,50 +54,38 @@ Be conversational, warm, use emojis sparingly.
 Keep responses short and helpful."""
 
 
-def parse_form(file_bytes: bytes, filename: str = "document.pdf") -> str:
-    """Parse a PDF using Reducto and return extracted text."""
+def parse_form(file_path: Path, filename: str = "document.pdf") -> str:
+    """Parse a PDF on disk using Reducto and return extracted text."""
     client = _get_reducto()
-    
-    suffix = Path(filename).suffix or ".pdf"
-    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-        tmp.write(file_bytes)
-        tmp_path = Path(tmp.name)
-    
-    try:
-        logger.info("Uploading %s to Reducto (%d bytes)", filename, len(file_bytes))
-        upload_result = client.upload(file=tmp_path)
-        
-        logger.info("Parsing with Reducto (file_id: %s)", upload_result.file_id)
-        parse_response = client.parse.run(
-            input=f"reducto://{upload_result.file_id}",
-        )
-        
-        result = parse_response.result
-        chunks = []
-        
-        if hasattr(result, "chunks"):
-            for chunk in result.chunks:
-                if chunk.content:
-                    chunks.append(chunk.content)
-        elif hasattr(result, "url"):
-            logger.info("Fetching result from URL: %s", result.url)
-            resp = requests.get(result.url, timeout=120)
-            resp.raise_for_status()
-            data = resp.json()
-            for chunk in data.get("chunks", []):
-                content = chunk.get("content", "")
-                if content:
-                    chunks.append(content)
-        
-        combined = "\n\n".join(chunks)
-        logger.info("Parsed %s: %d chunks, %d chars", filename, len(chunks), len(combined))
-        return combined
-        
-    finally:
-        try:
-            tmp_path.unlink()
-        except OSError:
-            pass
+
+    logger.info("Uploading %s to Reducto (%d bytes)", filename, Path(file_path).stat().st_size)
+    upload_result = client.upload(file=Path(file_path))
+
+    logger.info("Parsing with Reducto (file_id: %s)", upload_result.file_id)
+    parse_response = client.parse.run(
+        input=f"reducto://{upload_result.file_id}",
+    )
+
+    result = parse_response.result
+    chunks = []
+
+    if hasattr(result, "chunks"):
+        for chunk in result.chunks:
+            if chunk.content:
+                chunks.append(chunk.content)
+    elif hasattr(result, "url"):
+        logger.info("Fetching result from URL: %s", result.url)
+        resp = requests.get(result.url, timeout=120)
+        resp.raise_for_status()
+        data = resp.json()
+        for chunk in data.get("chunks", []):
+            content = chunk.get("content", "")
+            if content:
+                chunks.append(content)
+
+    combined = "\n\n".join(chunks)
+    logger.info("Parsed %s: %d chunks, %d chars", filename, len(chunks), len(combined))
+    return combined
 
 
 def identify_form(parsed_text: str) -> str:
@@ -116,43 +107,33 @@ def identify_form(parsed_text: str) -> str:
     return response.choices[0].message.content.strip()
 
 
-def fill_form(file_bytes: bytes, filename: str, fill_instructions: str) -> str:
-    """Fill a PDF form using Reducto Edit API. Returns URL to filled PDF."""
+def fill_form(file_path: Path, filename: str, fill_instructions: str) -> str:
+    """Fill a PDF form on disk using Reducto Edit API. Returns URL to filled PDF."""
     client = _get_reducto()
-    
-    suffix = Path(filename).suffix or ".pdf"
-    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-        tmp.write(file_bytes)
-        tmp_path = Path(tmp.name)
-    
-    try:
-        logger.info("Uploading form for filling: %s", filename)
-        upload_result = client.upload(file=tmp_path)
-        
-        logger.info("Filling form with Reducto Edit API")
-        edit_response = client.edit.run(
-            document_url=f"reducto://{upload_result.file_id}",
-            edit_instructions=fill_instructions,
-        )
-        
-        filled_url = edit_response.document_url
-        logger.info("Form filled successfully: %s", filled_url)
-        return filled_url
-        
-    finally:
-        try:
-            tmp_path.unlink()
-        except OSError:
-            pass
-
-
-def download_filled_pdf(url: str, save_path: Path) -> Path:
-    """Download a filled PDF from Reducto URL and save locally."""
+
+    logger.info("Uploading form for filling: %s", filename)
+    upload_result = client.upload(file=Path(file_path))
+
+    logger.info("Filling form with Reducto Edit API")
+    edit_response = client.edit.run(
+        document_url=f"reducto://{upload_result.file_id}",
+        edit_instructions=fill_instructions,
+    )
+
+    filled_url = edit_response.document_url
+    logger.info("Form filled successfully: %s", filled_url)
+    return filled_url
+
+
+async def download_filled_pdf(url: str, save_path: Path) -> Path:
+    """Stream a filled PDF from Reducto URL to disk without blocking the event loop."""
     logger.info("Downloading filled PDF from: %s", url)
-    response = requests.get(url, timeout=120)
-    response.raise_for_status()
-    
-    save_path.write_bytes(response.content)
+    async with httpx.AsyncClient(timeout=120) as client:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            with open(save_path, "wb") as f:
+                async for chunk in response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
     logger.info("Saved filled PDF to: %s", save_path)
     return save_path
 
@@ -1,9 +1,18 @@
 """State machine and McLovin demo data for immigration document flow."""
 
+import os
 from enum import Enum
-from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from dataclasses import dataclass, field, asdict
 from typing import Optional
 
+import orjson
+
+from _env import load_env
+
+load_env()
+
 class State(str, Enum):
     WAITING_FOR_FORM = "waiting_for_form"
     WAITING_FOR_LICENSE = "waiting_for_license"
@@ -114,7 +123,7 @@ def extract_investigation_profile(rfe_text: str, profile_text: str,
 class Session:
     """Represents a user session with state and stored form data."""
     state: State = State.WAITING_FOR_FORM
-    form_bytes: Optional[bytes] = None
+    form_path: Optional[str] = None  # spooled upload, kept until the form is filled
     form_filename: Optional[str] = None
     form_type: Optional[str] = None
     filled_pdf_path: Optional[str] = None
@@ -128,18 +137,61 @@ class Session:
     investigation_result: Optional[dict] = None
 
 
-# In-memory session storage
+# Sessions live in Redis when REDIS_URL is set, so every Uvicorn worker sees
+# the same state; otherwise they fall back to this process's memory
+REDIS_URL = os.getenv("REDIS_URL")
+SESSION_TTL = 3600  # seconds of inactivity before Redis drops a session
 sessions: dict[str, Session] = {}
 
 
-def get_session(session_id: str) -> Session:
+@lru_cache(maxsize=1)
+def _get_redis():
+    """Return the process-wide async Redis client, or None if REDIS_URL is unset."""
+    if not REDIS_URL:
+        return None
+    import redis.asyncio as redis
+    return redis.from_url(REDIS_URL)
+
+
+def _session_key(session_id: str) -> str:
+    return f"pumpkin:session:{session_id}"
+
+
+def _load(raw: bytes) -> Session:
+    data = orjson.loads(raw)
+    data["state"] = State(data["state"])
+    return Session(**data)
+
+
+async def get_session(session_id: str) -> Session:
     """Get or create a session."""
-    if session_id not in sessions:
-        sessions[session_id] = Session()
-    return sessions[session_id]
+    r = _get_redis()
+    if r is None:
+        if session_id not in sessions:
+            sessions[session_id] = Session()
+        return sessions[session_id]
+    raw = await r.get(_session_key(session_id))
+    return _load(raw) if raw else Session()
 
 
-def reset_session(session_id: str) -> Session:
-    """Reset a session to initial state."""
-    sessions[session_id] = Session()
-    return sessions[session_id]
+async def save_session(session_id: str, session: Session) -> None:
+    """Write a session back to Redis and refresh its TTL (no-op in memory).
+
+    The stored form stays on disk; only its path is serialised.
+    """
+    r = _get_redis()
+    if r is None:
+        sessions[session_id] = session
+        return
+    raw = orjson.dumps(asdict(session), option=orjson.OPT_SERIALIZE_NUMPY)
+    await r.set(_session_key(session_id), raw, ex=SESSION_TTL)
+
+
+async def reset_session(session_id: str) -> Session:
+    """Reset a session to initial state, removing any stored form upload."""
+    old = await get_session(session_id)
+    if old.form_path:
+        Path(old.form_path).unlink(missing_ok=True)
+    session = Session()
+    await save_session(session_id, session)
+    return session
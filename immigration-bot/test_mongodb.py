@@ -1,23 +1,21 @@
 """Test script to verify MongoDB data and GridFS setup."""
 
-import os
 from pathlib import Path
-from dotenv import load_dotenv
-from pymongo import MongoClient
 from gridfs import GridFS
 
+from _env import load_env
+from db import get_client
+
 # Load environment variables
-env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(env_path)
+load_env()
 
-MONGODB_URI = os.environ.get("MONGODB_URI")
 DATABASE_NAME = "rfe_tool"
 
 def main():
     """Run all verification tests."""
 
     # Connect to MongoDB
-    client = MongoClient(MONGODB_URI)
+    client = get_client()
     db = client[DATABASE_NAME]
     fs = GridFS(db)
     cases = db["cases"]
@@ -3,13 +3,13 @@
 import os
 from pathlib import Path
 from datetime import datetime
-from dotenv import load_dotenv
-from pymongo import MongoClient
 from gridfs import GridFS
 
+from _env import load_env
+from db import get_client, ensure_case_indexes
+
 # Load environment variables
-env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(env_path)
+env_path = load_env()
 
 MONGODB_URI = os.environ.get("MONGODB_URI")
 if not MONGODB_URI:
@@ -24,10 +24,11 @@ def upload_pdfs():
 
     # Connect to MongoDB
     print(f"Connecting to MongoDB...")
-    client = MongoClient(MONGODB_URI)
+    client = get_client()
     db = client[DATABASE_NAME]
     fs = GridFS(db)
     cases_collection = db["cases"]
+    ensure_case_indexes(cases_collection)
 
     print(f"Connected to database: {DATABASE_NAME}")
     print(f"Scanning folder: {PDF_FOLDER}")
@@ -1,18 +1,14 @@
 """Upload H-1B AAO cases to Nomic Atlas for interactive visualization."""
 
-import os
-from pathlib import Path
-from dotenv import load_dotenv
-
 import numpy as np
-from pymongo import MongoClient
 from nomic import atlas
 
+from _env import load_env
+from db import get_client
+
 # Load environment variables
-env_path = Path(__file__).parent.parent / ".env"
-load_dotenv(env_path)
+load_env()
 
-MONGODB_URI = os.environ.get("MONGODB_URI")
 DATABASE_NAME = "rfe_tool"
 
 
@@ -25,7 +21,7 @@ def main():
 
     # Connect to MongoDB
     print("\n[1/3] Connecting to MongoDB...")
-    client = MongoClient(MONGODB_URI)
+    client = get_client()
     db = client[DATABASE_NAME]
     cases_collection = db["cases"]
 